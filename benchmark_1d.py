@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+
+__doc__ = """benchmark_1d
+============
+
+Benchmarks the build and evaluation of the 1D surrogate of
+ICERM-build-1d-model.ipynb, across training set sizes and basis sizes.
+
+For each training set size, the wall time and peak memory (of allocations
+traced by tracemalloc, which includes numpy arrays) are recorded for:
+align (align_and_pad), svd (build_basis), and, for each basis size,
+eim (EmpiricalInterpolant), fit (build_surrogate), single_q (one sur(q)
+call) and batched (one sur(qs) call for --num_eval q values).
+
+Each stage is timed over several untraced runs (--num_repeats for
+single_q, --num_build_repeats for the others), and the minimum and median
+times are recorded. The peak memory is measured in one separate run under
+tracemalloc, as its allocation hooks slow down the code they trace.
+
+The results are written to a JSON file. If a baseline JSON file from an
+earlier run is given, the times are compared against it and stages that
+got slower by more than --threshold are reported. The baseline must have
+been run with the same configuration (CONFIG_KEYS: training data, SVD
+method, dtype, --num_eval and the numbers of repeats), else the comparison
+is refused.
+
+Without --training_data, synthetic chirps are used, so that this runs
+without lal.
+
+Example usage:
+./benchmark_1d.py --training_sizes 25 50 100 --basis_sizes 5 10 20
+    --output bench.json --baseline bench_baseline.json
+"""
+
+import numpy as np
+import argparse
+import json
+import time
+import tracemalloc
+import platform
+import datetime
+
+import surrogate_1d
+import eob_training
+
+# Run options that change the timings. Baselines are only compared if they
+# agree on all of these.
+CONFIG_KEYS = ['training_data', 'svd_method', 'dtype', 'num_eval', \
+    'num_repeats', 'num_build_repeats']
+
+
+#----------------------------------------------------------------------------
+def synthetic_waveform(q, dt=1.0/2048., duration=8.0):
+    """ A smooth chirp that roughly mimics the (2,2) mode, with a leading
+    order post-Newtonian phase, and a ringdown after the peak. Only meant
+    for benchmarking, not physics.
+    """
+    eta = q/(1.+q)**2
+    t_peak = duration*(0.9 + 0.1*(q - 1.))
+    t = np.arange(int((t_peak + 0.1)/dt))*dt
+    tau = np.sqrt((t_peak - t)**2 + 1e-4)
+    phase = -2*(5*tau/eta)**(5./8.)
+    amp = tau**(-0.25)/(1 + np.exp((t - t_peak)/0.005))
+    return amp*np.exp(1j*phase)
+
+#----------------------------------------------------------------------------
+def time_stage(func, args=(), kwargs=None, num_repeats=1):
+    """ Runs func(*args, **kwargs) num_repeats times, timed with
+    time.perf_counter, and then once more with tracemalloc, whose
+    allocation hooks would distort the times, for the peak memory.
+
+    Returns the output, the minimum and median wall times, and the peak
+    traced memory in bytes.
+    """
+    if kwargs is None:
+        kwargs = {}
+
+    times = []
+    for idx in range(num_repeats):
+        start = time.perf_counter()
+        out = func(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    out = func(*args, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return out, float(np.min(times)), float(np.median(times)), peak
+
+#----------------------------------------------------------------------------
+def run_benchmarks(get_training_set, training_sizes, basis_sizes, \
+        num_eval=100, num_repeats=20, num_build_repeats=3, svd_method='svd', \
+        dtype=complex):
+    """ Runs the benchmarks.
+
+    get_training_set: function that returns (qs, training_data, dt) for a
+        given training set size.
+    num_repeats: number of timed runs of single_q.
+    num_build_repeats: number of timed runs of the other stages.
+    dtype: dtype of the aligned training data and the surrogate basis.
+
+    Returns a list of results, one dict per (stage, num_samples,
+    basis_size), with basis_size None for stages that don't depend on it.
+    """
+    results = []
+    def record(stage, num_samples, basis_size, timing, peak, **extra):
+        time_min, time_median = timing
+        result = {'stage': stage, 'num_samples': num_samples, \
+            'basis_size': basis_size, 'time': time_min, \
+            'time_median': time_median, 'peak_memory': peak}
+        result.update(extra)
+        results.append(result)
+        print('%-10s N=%-6d basis=%-5s %.3e s (median %.3e s)  %.1f MB'%( \
+            stage, num_samples, basis_size, time_min, time_median, peak/1e6))
+
+    for num_samples in training_sizes:
+        qs, training_data, dt = get_training_set(num_samples)
+
+        (times, training_data_aligned, _), time_min, time_median, peak \
+            = time_stage(surrogate_1d.align_and_pad, (training_data, dt), \
+            {'dtype': dtype}, num_repeats=num_build_repeats)
+        record('align', num_samples, None, (time_min, time_median), peak, \
+            num_times=len(times))
+
+        (basis, s), time_min, time_median, peak = time_stage( \
+            surrogate_1d.build_basis, (training_data_aligned,), \
+            {'tol': 1e-14, 'max_size': max(basis_sizes), \
+            'method': svd_method}, num_repeats=num_build_repeats)
+        record('svd', num_samples, None, (time_min, time_median), peak)
+
+        q_eval = np.linspace(np.min(qs), np.max(qs), num_eval)
+        for basis_size in basis_sizes:
+            if basis_size > basis.shape[1]:
+                continue
+
+            eim, time_min, time_median, peak = time_stage( \
+                surrogate_1d.EmpiricalInterpolant, \
+                (basis[:, :basis_size].transpose(),), \
+                num_repeats=num_build_repeats)
+            record('eim', num_samples, basis_size, (time_min, time_median), \
+                peak)
+
+            sur, time_min, time_median, peak = time_stage( \
+                surrogate_1d.build_surrogate, (qs, training_data_aligned, \
+                times, eim), {'dtype': dtype}, num_repeats=num_build_repeats)
+            record('fit', num_samples, basis_size, (time_min, time_median), \
+                peak)
+
+            _, time_min, time_median, peak = time_stage(sur, \
+                (q_eval[num_eval//2],), num_repeats=num_repeats)
+            record('single_q', num_samples, basis_size, \
+                (time_min, time_median), peak)
+
+            _, time_min, time_median, peak = time_stage(sur, (q_eval,), \
+                num_repeats=num_build_repeats)
+            record('batched', num_samples, basis_size, \
+                (time_min, time_median), peak, throughput=num_eval/time_min)
+
+    return results
+
+#----------------------------------------------------------------------------
+def compare_to_baseline(results, baseline, config, threshold=1.2):
+    """ Prints the ratio of the times in results to the matching ones in
+    baseline, and returns the results that are slower than threshold times
+    the baseline.
+
+    config: dict of the CONFIG_KEYS of results. Raises an Exception if the
+        baseline was run with a different configuration.
+    """
+    mismatches = ['%s: %s (baseline %s)'%(name, config[name], \
+        baseline.get(name, 'not recorded')) for name in CONFIG_KEYS \
+        if baseline.get(name, None) != config[name]]
+    if len(mismatches) > 0:
+        raise Exception('Baseline was run with a different configuration, ' \
+            'not comparing. %s'%', '.join(mismatches))
+    for name in ['machine', 'numpy']:
+        if baseline.get(name, None) != config.get(name, None):
+            print('Note: baseline %s is %s, not %s'%(name, \
+                baseline.get(name, None), config.get(name, None)))
+
+    def key(result):
+        return (result['stage'], result['num_samples'], result['basis_size'])
+    baseline_times = dict((key(result), result['time']) \
+        for result in baseline['results'])
+
+    regressions = []
+    print('\n%-10s %-8s %-6s %s'%('stage', 'N', 'basis', 'time/baseline'))
+    for result in results:
+        if key(result) not in baseline_times:
+            continue
+        ratio = result['time']/baseline_times[key(result)]
+        flag = ''
+        if ratio > threshold:
+            flag = ' <-- regression'
+            regressions.append(result)
+        print('%-10s %-8d %-6s %.2f%s'%(result['stage'], \
+            result['num_samples'], result['basis_size'], ratio, flag))
+    return regressions
+
+
+#############################    main    ##################################
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('--training_data', type=str, default=None,
+        help='Training set written by eob_training. Training sets of each ' \
+            'size are evenly spaced subsets of it. If not given, synthetic ' \
+            'chirps are used.')
+    parser.add_argument('--training_sizes', type=int, nargs='+',
+        default=[25, 50, 100], help='Training set sizes.')
+    parser.add_argument('--basis_sizes', type=int, nargs='+',
+        default=[5, 10, 20], help='Basis sizes.')
+    parser.add_argument('--num_eval', type=int, default=100,
+        help='Number of q values for the batched evaluation.')
+    parser.add_argument('--num_repeats', type=int, default=20,
+        help='Number of timed runs of single_q.')
+    parser.add_argument('--num_build_repeats', type=int, default=3,
+        help='Number of timed runs of the other stages.')
+    parser.add_argument('--svd_method', type=str, default='svd',
+        help='Method for surrogate_1d.build_basis.')
+    parser.add_argument('--single_precision', default=False,
+        action='store_true', help='Use complex64 training data and basis.')
+    parser.add_argument('--output', type=str, default='benchmark_1d.json',
+        help='JSON file to write the results to.')
+    parser.add_argument('--baseline', type=str, default=None,
+        help='JSON file of an earlier run to compare against.')
+    parser.add_argument('--threshold', type=float, default=1.2,
+        help='Slowdown relative to the baseline reported as a regression.')
+
+    args = parser.parse_args()
+
+    if args.training_data is None:
+        def get_training_set(num_samples):
+            qs = np.linspace(1.0, 2.0, num_samples)
+            dt = 1.0/2048.
+            return qs, [synthetic_waveform(q, dt=dt) for q in qs], dt
+    else:
+        training_set = eob_training.TrainingSet(args.training_data)
+        def get_training_set(num_samples):
+            idx = np.unique(np.linspace(0, len(training_set) - 1, \
+                num_samples).round().astype(int))
+            return training_set.qs[idx], [training_set[i] for i in idx], \
+                training_set.attrs['dt']
+
+    dtype = np.complex64 if args.single_precision else complex
+    results = run_benchmarks(get_training_set, args.training_sizes, \
+        args.basis_sizes, num_eval=args.num_eval, \
+        num_repeats=args.num_repeats, \
+        num_build_repeats=args.num_build_repeats, svd_method=args.svd_method, \
+        dtype=dtype)
+
+    config = {
+        'machine': platform.platform(),
+        'numpy': np.__version__,
+        'training_data': args.training_data,
+        'svd_method': args.svd_method,
+        'dtype': np.dtype(dtype).name,
+        'num_eval': args.num_eval,
+        'num_repeats': args.num_repeats,
+        'num_build_repeats': args.num_build_repeats,
+        }
+    output = dict(config, created=datetime.datetime.now().isoformat(), \
+        results=results)
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=1)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, config, \
+            threshold=args.threshold)
+        if len(regressions) > 0:
+            print('\n%d stages slower than %.2f times the baseline'%( \
+                len(regressions), args.threshold))
@@ -40,6 +40,7 @@ THE SOFTWARE.
 
 import numpy as np
 import os
+import threading
 #if os.environ.get('DISPLAY','') == '':
 #   print('No display found. Using non-interactive Agg backend')
 #   import matplotlib as mpl
@@ -135,6 +136,14 @@ if LOW_DEF:
 # Time at which to freeze video for 5 seconds
 FREEZE_TIME = -100
 
+# Unix socket of a running model_server.py. If set, NRSur7dq2 and the
+# surfinBH fits are evaluated by the server instead of being loaded here.
+MODEL_SERVER = os.environ.get('BBH_MODEL_SERVER', None)
+
+# Remnant lookup table written by remnant_table.py. If set, the remnant
+# properties are looked up there instead of evaluating the surfinBH fit.
+REMNANT_TABLE = os.environ.get('BBH_REMNANT_TABLE', None)
+
 
 zorder_dict = {
         'contourf': -200,
@@ -467,6 +476,71 @@ def get_waveform_timeseries(h_dict, azim, elev):
         h += h_dict[key]*ylm
     return h
 
+#----------------------------------------------------------------------------
+def get_equal_area_sky_grid(num_theta, num_phi):
+    """ Returns flattened (th, ph) arrays for num_theta*num_phi directions
+    at the centers of equal-area cells on the sky. The cells are uniform in
+    cos(th) and ph, with th varying slowest. Also returns the cell edges
+    in cos(th) and ph, which are needed for plotting maps.
+    """
+    cos_th_edges = np.linspace(1, -1, num_theta+1)
+    ph_edges = np.linspace(-np.pi, np.pi, num_phi+1)
+    cos_th = 0.5*(cos_th_edges[1:] + cos_th_edges[:-1])
+    ph_1d = 0.5*(ph_edges[1:] + ph_edges[:-1])
+
+    th, ph = np.meshgrid(np.arccos(cos_th), ph_1d, indexing='ij')
+    return th.ravel(), ph.ravel(), cos_th_edges, ph_edges
+
+#----------------------------------------------------------------------------
+def get_harmonics_matrix(modes, th, ph, dtype=complex):
+    """ Returns the (directions x modes) matrix of spin-weighted spherical
+    harmonics, sYlm(-2, ell, m, th, ph), for each (ell, m) in modes.
+    """
+    th = np.atleast_1d(th)
+    ph = np.atleast_1d(ph)
+    sYlm = np.vectorize(harmonics.sYlm)
+    Y = np.empty((len(th), len(modes)), dtype=dtype)
+    for idx, (ell, m) in enumerate(modes):
+        Y[:, idx] = sYlm(-2, ell, m, th, ph)
+    return Y
+
+#----------------------------------------------------------------------------
+def get_waveform_on_sky(h_dict, th, ph, chunk_size=4096, dtype=np.complex64, \
+        out_file=None):
+    """ Bulk version of get_waveform_timeseries. Computes the strain
+    h = sum_lm h_lm sYlm(-2, ell, m, th, ph) in all given directions at once.
+
+    th, ph: polar and azimuthal angles (radians) of the directions, for eg.
+        from get_equal_area_sky_grid.
+    chunk_size: number of directions per matrix product, bounds the memory
+        used for intermediate results.
+    dtype: complex dtype of the output. The default complex64 stores h+ and
+        hx (real and imaginary parts, as in the time series panel) as
+        float32.
+    out_file: If given, the result is written to a memory-mapped .npy file
+        at this path instead of being held in memory.
+
+    Returns an array of shape (directions x times).
+    """
+    modes = list(h_dict.keys())
+    Y = get_harmonics_matrix(modes, th, ph, dtype=dtype)
+    h_modes = np.array([h_dict[key] for key in modes], dtype=dtype)
+
+    shape = (Y.shape[0], h_modes.shape[1])
+    if out_file is None:
+        h_sky = np.empty(shape, dtype=dtype)
+    else:
+        h_sky = np.lib.format.open_memmap(out_file, mode='w+', dtype=dtype, \
+            shape=shape)
+
+    for start in range(0, shape[0], chunk_size):
+        h_sky[start:start+chunk_size] = np.dot(Y[start:start+chunk_size], \
+            h_modes)
+
+    if out_file is not None:
+        h_sky.flush()
+    return h_sky
+
 
 #----------------------------------------------------------------------------
 def get_camera_trajectory(t_binary, period=1000, stop_time=-500, azim_shift=1):
@@ -494,14 +568,48 @@ def get_camera_trajectory(t_binary, period=1000, stop_time=-500, azim_shift=1):
     return [elev_vec, azim_vec]
 
 
+#----------------------------------------------------------------------------
+def load_NRSur7dq2():
+    """ NRSur7dq2 surrogate, from the model server if MODEL_SERVER is set.
+    """
+    if MODEL_SERVER is None:
+        return NRSur7dq2.NRSurrogate7dq2()
+    import model_server
+    return model_server.ModelClient(MODEL_SERVER).get_model('NRSur7dq2')
+
+#----------------------------------------------------------------------------
+def load_fit(fit_name):
+    """ surfinBH fit, from the model server if MODEL_SERVER is set. If
+    REMNANT_TABLE is set, returns the table instead, which falls back to the
+    fit where it cannot be used.
+    """
+    fit = None
+    if MODEL_SERVER is not None:
+        import model_server
+        fit = model_server.ModelClient(MODEL_SERVER).get_model(fit_name)
+
+    if REMNANT_TABLE is None:
+        if fit is None:
+            fit = surfinBH.LoadFits(fit_name)
+        return fit
+
+    # If fit is None, the table only loads the fit if it falls back to it
+    import remnant_table
+    table = remnant_table.RemnantTable(REMNANT_TABLE, fit=fit)
+    if table.fit_name != fit_name:
+        raise Exception('REMNANT_TABLE is a table of %s, not %s'%( \
+            table.fit_name, fit_name))
+    return table
+
 #----------------------------------------------------------------------------
 def get_binary_data(q, chiA, chiB, omega_ref, omega_start=None, \
-        uniform_time_step_size=None):
+        uniform_time_step_size=None, nr_sur=None):
 
     mA = q/(1.+q)
     mB = 1./(1.+q)
 
-    nr_sur = NRSur7dq2.NRSurrogate7dq2()
+    if nr_sur is None:
+        nr_sur = load_NRSur7dq2()
 
     # If omega_ref is not given, set f_ref to None, and t_ref to -100
     f_ref = None if omega_ref is None else omega_ref/np.pi
@@ -587,7 +695,8 @@ def update_lines(num, lines, hist_frames, t, t_binary, dataLines_binary, \
         q, mA, mB, chiA_nrsur, chiB_nrsur, mf, chif, vf, \
         waveform_end_time, freeze_idx, draw_full_trajectory, ax, vmin, vmax, \
         linthresh, camera_traj, height_map, project_on_all_planes, \
-        no_wave_time_series, no_freeze_near_merger, no_time_label, use_Kerr):
+        no_wave_time_series, no_freeze_near_merger, no_time_label, use_Kerr, \
+        no_wave_planes=False):
     """ The function that goes into animation
     """
     current_time = t[num]
@@ -604,7 +713,7 @@ def update_lines(num, lines, hist_frames, t, t_binary, dataLines_binary, \
 
     ax.collections = []     # It becomes very slow without this
 
-    if current_time < waveform_end_time:
+    if current_time < waveform_end_time and not no_wave_planes:
         # Plot the waveform on the back planes
         if project_on_all_planes:
             hplusX = get_waveform_on_grid(t, num-1, h_nrsur, sph_gridX)
@@ -629,7 +738,7 @@ def update_lines(num, lines, hist_frames, t, t_binary, dataLines_binary, \
             ax.contourf(gridZ[0], gridZ[1], hplusZ, zdir='z', \
                 offset=-max_range, cmap=cm.coolwarm, \
                 zorder=zorder_dict['contourf'], vmin=vmin, vmax=vmax, norm=norm)
-    else:
+    elif current_time >= waveform_end_time:
         timestep_text.set_text('Increased time step to 100M')
 
     if current_time < 0:        # Show binary until t=0
@@ -734,20 +843,35 @@ def update_lines(num, lines, hist_frames, t, t_binary, dataLines_binary, \
 
 
 #----------------------------------------------------------------------------
-def BBH_animation(fig, q, chiA, chiB, omega_ref=None, \
-        draw_full_trajectory=False, project_on_all_planes=False, \
-        height_map=False, auto_rotate_camera=False, save_file=None, \
-        still_time=None,  rescale_fig_for_widgets=False, \
-        no_freeze_near_merger=False, omega_start=None, \
-        no_wave_time_series=False, uniform_time_step_size=None, \
-        no_time_label=False, no_surrogate_label=False, \
-        use_spin_angular_momentum_for_arrows=False):
+def get_animation_times(t_binary, waveform_end_time, dt_remnant):
+    """ Common time array of the binary and the remnant: t_binary until
+    waveform_end_time, then steps of dt_remnant.
+    """
+    t = np.append(t_binary[t_binary<waveform_end_time], \
+        np.arange(waveform_end_time, 10000+waveform_end_time, dt_remnant))
 
+    if HANGUP_HACKS:
+        t = t[t - t[0] <= 4100]
+    return t
+
+#----------------------------------------------------------------------------
+def get_animation_data(q, chiA, chiB, omega_ref=None, omega_start=None, \
+        uniform_time_step_size=None, dt_remnant=None, nr_sur=None, \
+        fit=None):
+    """ Everything BBH_animation needs to know about the binary and the
+    remnant, as a dict. nr_sur and fit can be given to reuse already loaded
+    models, else NRSur7dq2 and surfinBH7dq2 are loaded.
+
+    dt_remnant: time step after the waveform ends. Default:
+        uniform_time_step_size if given, else 100M to exaggerate kicks.
+    """
     chiA = np.array(chiA)
     chiB = np.array(chiB)
     t_binary, chiA_nrsur, chiB_nrsur, L, h_nrsur, BhA_traj, \
         BhB_traj, separation = get_binary_data(q, chiA, chiB, omega_ref, \
-        omega_start=omega_start, uniform_time_step_size=uniform_time_step_size)
+        omega_start=omega_start, \
+        uniform_time_step_size=uniform_time_step_size, \
+        nr_sur=nr_sur)
 
     max_range = np.nanmax(np.linalg.norm(BhB_traj, axis=0))
 
@@ -762,8 +886,8 @@ def BBH_animation(fig, q, chiA, chiB, omega_ref=None, \
         = get_grids_on_planes(11, max_range)
 
     # evaluate remnant fit
-    fit_name = 'surfinBH7dq2'
-    fit = surfinBH.LoadFits(fit_name)
+    if fit is None:
+        fit = load_fit('surfinBH7dq2')
 
     # If omega_ref is None, will assume the spins are given in the
     # coorbital frame at t=-100M
@@ -784,25 +908,83 @@ def BBH_animation(fig, q, chiA, chiB, omega_ref=None, \
     # propagation delay
     waveform_end_time = 50 + 2*max_range
 
-    if uniform_time_step_size is None:
-        # Use large step size after ringdown to exaggerate kicks
-        dt_remnant = 100
-    else:
-        dt_remnant = uniform_time_step_size
-
-    # common time array: After waveform_end_time, each step is 100M
-    t = np.append(t_binary[t_binary<waveform_end_time], \
-        np.arange(waveform_end_time, 10000+waveform_end_time, dt_remnant))
+    if dt_remnant is None:
+        if uniform_time_step_size is None:
+            # Use large step size after ringdown to exaggerate kicks
+            dt_remnant = 100
+        else:
+            dt_remnant = uniform_time_step_size
 
-    if HANGUP_HACKS:
-        t = t[t - t[0] <= 4100]
+    t = get_animation_times(t_binary, waveform_end_time, dt_remnant)
 
     # assume merger is at origin
     BhC_traj = np.array([tmp*t for tmp in vf])
 
+    # estimate maximum of waveform for scale of timeseries
+    hmax_est = np.max(np.abs(get_waveform_timeseries(h_nrsur, 0, 90)))
+
+    # Will freeze video at this index
+    freeze_idx = np.argmin(np.abs(t - FREEZE_TIME))
+
+    # color range for contourf
+    # Get linthresh from first index. With SymLogNorm, whenever the
+    # value is less than linthresh, the color scale is linear. Else log.
+    linthresh = np.max(np.abs(get_waveform_on_grid(t, 0, h_nrsur, sph_gridZ)))
+    # Get vmax from waveform at peak.  Add in propagation delay
+    zero_idx = np.argmin(np.abs(t-max_range))
+    vmax = np.max(get_waveform_on_grid(t, zero_idx, h_nrsur, \
+                                       sph_gridZ))
+    # Symmetric about 0
+    vmin = -vmax
+
+    return {
+        'q': q, 'mA': mA, 'mB': mB,
+        't': t, 't_binary': t_binary,
+        'chiA_nrsur': chiA_nrsur, 'chiB_nrsur': chiB_nrsur,
+        'L': L, 'h_nrsur': h_nrsur,
+        'BhA_traj': BhA_traj, 'BhB_traj': BhB_traj, 'BhC_traj': BhC_traj,
+        'mf': mf, 'chif': chif, 'vf': vf,
+        'shape_BhA': shape_BhA, 'shape_BhB': shape_BhB,
+        'shape_BhC': shape_BhC,
+        'sph_gridX': sph_gridX, 'gridX': gridX,
+        'sph_gridY': sph_gridY, 'gridY': gridY,
+        'sph_gridZ': sph_gridZ, 'gridZ': gridZ,
+        'max_range': max_range, 'waveform_end_time': waveform_end_time,
+        'hmax_est': hmax_est, 'freeze_idx': freeze_idx,
+        'linthresh': linthresh, 'vmin': vmin, 'vmax': vmax,
+        }
+
+#----------------------------------------------------------------------------
+def set_animation_ranges(ax, hax, data):
+    """ Sets the axes limits that depend on the binary.
+    """
+    max_range = data['max_range']
+
+    # This seems to set the actual limits to max_range
+    ax.set_xlim3d([-max_range*0.96, max_range*0.96])
+    ax.set_ylim3d([-max_range*0.96, max_range*0.96])
+    ax.set_zlim3d([-max_range*0.96, max_range*0.96])
+
+    if hax is not None:
+        hax.set_ylim([ -data['hmax_est'], data['hmax_est'] ])
+        if HANGUP_HACKS:
+            hax.set_xlim(0, 4100)
+
+#----------------------------------------------------------------------------
+def draw_animation_artists(fig, data, rescale_fig_for_widgets=False, \
+        no_wave_time_series=False, no_surrogate_label=False, \
+        fit_name='surfinBH7dq2'):
+    """ Creates the axes, texts and lines of BBH_animation, drawn with
+    update_lines. Returns them as a dict.
+    """
+    t_binary = data['t_binary']
+    BhA_traj = data['BhA_traj']
+    BhB_traj = data['BhB_traj']
+
     # Attaching 3D axis to the figure
     ax = axes3d.Axes3D(fig)
 
+    hax = None
     if not no_wave_time_series:
         l, b, w, h = ax.get_position().bounds
         if rescale_fig_for_widgets:
@@ -816,18 +998,6 @@ def BBH_animation(fig, q, chiA, chiB, omega_ref=None, \
             hax = fig.add_axes([0.135, 0.08, 0.83, 0.17])
 
 
-        # estimate maximum of waveform for scale of timeseries
-        hmax_est = np.max(np.abs(get_waveform_timeseries(h_nrsur, 0, 90)))
-        hax.set_ylim([ -hmax_est, hmax_est ])
-        if HANGUP_HACKS:
-            hax.set_xlim(0, 4100)
-
-    if auto_rotate_camera:
-        camera_traj = get_camera_trajectory(t_binary)
-    else:
-        camera_traj = None
-
-
     if LOW_DEF:
         time_fontsize = 5
         properties_fontsize = 5
@@ -864,11 +1034,8 @@ def BBH_animation(fig, q, chiA, chiB, omega_ref=None, \
         zorder=zorder_dict['notice_text'])
 
 
-    # NOTE: Can't pass empty arrays into 3d version of plot()
-    dataLines_binary = [BhA_traj, BhB_traj, 1, 1, 1]
-
     # get wavefrom at viewpoint
-    h_viewpoint = get_waveform_timeseries(h_nrsur, ax.azim, ax.elev)
+    h_viewpoint = get_waveform_timeseries(data['h_nrsur'], ax.azim, ax.elev)
 
     if LOW_DEF:
         arrow_mutation_scale = 10
@@ -922,15 +1089,9 @@ def BBH_animation(fig, q, chiA, chiB, omega_ref=None, \
         hax.tick_params(axis='x', which='major', labelsize=ticks_fontsize)
         hax.tick_params(axis='y', which='major', labelsize=ticks_fontsize)
 
-    dataLines_remnant = [1]
-
 
     # Setting the axes properties
-
-    # This seems to set the actual limits to max_range
-    ax.set_xlim3d([-max_range*0.96, max_range*0.96])
-    ax.set_ylim3d([-max_range*0.96, max_range*0.96])
-    ax.set_zlim3d([-max_range*0.96, max_range*0.96])
+    set_animation_ranges(ax, hax, data)
 
     ax.set_xlabel('$x\,(M)$', fontsize=label_fontsize)
     ax.set_ylabel('$y\,(M)$', fontsize=label_fontsize)
@@ -964,23 +1125,49 @@ def BBH_animation(fig, q, chiA, chiB, omega_ref=None, \
         ax.set_title('NRSur7dq2 + %s'%fit_name, fontsize=time_fontsize, \
             x=0.74, y=0.99)
 
-    # number of frames to include in orbit trace
-    hist_frames = int(0.75*(PTS_PER_ORBIT))
+    return {
+        'ax': ax, 'hax': hax, 'lines': lines,
+        'time_text': time_text, 'properties_text': properties_text,
+        'freeze_text': freeze_text, 'timestep_text': timestep_text,
+        }
 
-    # Will freeze video at this index
-    freeze_idx = np.argmin(np.abs(t - FREEZE_TIME))
+#----------------------------------------------------------------------------
+def get_update_fargs(data, artists, hist_frames, camera_traj=None, \
+        draw_full_trajectory=False, height_map=False, \
+        project_on_all_planes=False, no_wave_time_series=False, \
+        no_freeze_near_merger=False, no_time_label=False, use_Kerr=True, \
+        no_wave_planes=False):
+    """ The arguments of update_lines after the frame number.
+    """
+    # NOTE: Can't pass empty arrays into 3d version of plot()
+    dataLines_binary = [data['BhA_traj'], data['BhB_traj'], 1, 1, 1]
+    dataLines_remnant = [1]
 
+    return (artists['lines'], hist_frames, data['t'], data['t_binary'], \
+            dataLines_binary, dataLines_remnant, artists['properties_text'], \
+            artists['freeze_text'], artists['timestep_text'], \
+            artists['time_text'], data['max_range'], data['BhA_traj'], \
+            data['BhB_traj'], data['BhC_traj'], data['L'], data['h_nrsur'], \
+            data['shape_BhA'], data['shape_BhB'], data['shape_BhC'], \
+            data['sph_gridX'], data['gridX'], data['sph_gridY'], \
+            data['gridY'], data['sph_gridZ'], data['gridZ'], \
+            data['q'], data['mA'], data['mB'], data['chiA_nrsur'], \
+            data['chiB_nrsur'], data['mf'], data['chif'], data['vf'], \
+            data['waveform_end_time'], data['freeze_idx'], \
+            draw_full_trajectory, artists['ax'], \
+            data['vmin'], data['vmax'], data['linthresh'], camera_traj, \
+            height_map, project_on_all_planes, no_wave_time_series, \
+            no_freeze_near_merger, no_time_label, use_Kerr, no_wave_planes)
 
-    # color range for contourf
-    # Get linthresh from first index. With SymLogNorm, whenever the
-    # value is less than linthresh, the color scale is linear. Else log.
-    linthresh = np.max(np.abs(get_waveform_on_grid(t, 0, h_nrsur, sph_gridZ)))
-    # Get vmax from waveform at peak.  Add in propagation delay
-    zero_idx = np.argmin(np.abs(t-max_range))
-    vmax = np.max(get_waveform_on_grid(t, zero_idx, h_nrsur, \
-                                       sph_gridZ))
-    # Symmetric about 0
-    vmin = -vmax
+#----------------------------------------------------------------------------
+def get_animation_frames(data, no_freeze_near_merger=False):
+    """ Frame numbers of the animation, and the number of frames to include
+    in the orbit trace.
+    """
+    t = data['t']
+
+    # number of frames to include in orbit trace
+    hist_frames = int(0.75*(PTS_PER_ORBIT))
 
     #NOTE: There is a glitch if I don't skip the first index
     frames = range(1, len(t))
@@ -993,23 +1180,51 @@ def BBH_animation(fig, q, chiA, chiB, omega_ref=None, \
 
     if not no_freeze_near_merger:
         # Repeat freeze_idx 75 times, this is a hacky way to freeze the video
-        frames = np.sort(np.append(frames, [freeze_idx]*75))
+        frames = np.sort(np.append(frames, [data['freeze_idx']]*75))
+
+    return frames, hist_frames
+
+#----------------------------------------------------------------------------
+def BBH_animation(fig, q, chiA, chiB, omega_ref=None, \
+        draw_full_trajectory=False, project_on_all_planes=False, \
+        height_map=False, auto_rotate_camera=False, save_file=None, \
+        still_time=None,  rescale_fig_for_widgets=False, \
+        no_freeze_near_merger=False, omega_start=None, \
+        no_wave_time_series=False, uniform_time_step_size=None, \
+        no_time_label=False, no_surrogate_label=False, \
+        use_spin_angular_momentum_for_arrows=False):
+
+    fit_name = 'surfinBH7dq2'
+    data = get_animation_data(q, chiA, chiB, omega_ref=omega_ref, \
+        omega_start=omega_start, \
+        uniform_time_step_size=uniform_time_step_size, \
+        fit=load_fit(fit_name))
+
+    artists = draw_animation_artists(fig, data, \
+        rescale_fig_for_widgets=rescale_fig_for_widgets, \
+        no_wave_time_series=no_wave_time_series, \
+        no_surrogate_label=no_surrogate_label, fit_name=fit_name)
+
+    if auto_rotate_camera:
+        camera_traj = get_camera_trajectory(data['t_binary'])
+    else:
+        camera_traj = None
+
+    frames, hist_frames = get_animation_frames(data, \
+        no_freeze_near_merger=no_freeze_near_merger)
 
     use_Kerr = not use_spin_angular_momentum_for_arrows
 
-    fargs = (lines, hist_frames, t, t_binary, dataLines_binary, \
-            dataLines_remnant, properties_text, freeze_text, timestep_text, \
-            time_text, max_range, BhA_traj, BhB_traj, BhC_traj, L, h_nrsur, \
-            shape_BhA, shape_BhB, shape_BhC, \
-            sph_gridX, gridX, sph_gridY, gridY, sph_gridZ, gridZ, \
-            q, mA, mB, chiA_nrsur, chiB_nrsur, mf, chif, vf, \
-            waveform_end_time, freeze_idx, draw_full_trajectory, ax, \
-            vmin, vmax, linthresh, camera_traj, height_map, \
-            project_on_all_planes, no_wave_time_series, \
-            no_freeze_near_merger, no_time_label, use_Kerr)
+    fargs = get_update_fargs(data, artists, hist_frames, \
+        camera_traj=camera_traj, draw_full_trajectory=draw_full_trajectory, \
+        height_map=height_map, project_on_all_planes=project_on_all_planes, \
+        no_wave_time_series=no_wave_time_series, \
+        no_freeze_near_merger=no_freeze_near_merger, \
+        no_time_label=no_time_label, use_Kerr=use_Kerr)
 
     # save still and exit
     if still_time is not None:
+        t = data['t']
         time_tag = '%d'%(abs(still_time))
         if still_time < 0:
             time_tag = 'm%s'%time_tag
@@ -1025,6 +1240,240 @@ def BBH_animation(fig, q, chiA, chiB, omega_ref=None, \
 
     return line_ani
 
+#----------------------------------------------------------------------------
+class BBHExplorer(object):
+    """ Interactive explorer, for the widgets of binaryBHexp.ipynb.
+
+    Unlike calling BBH_animation for every new set of parameters, the
+    explorer keeps one figure, animation and set of loaded models. New
+    parameters are debounced: the binary is only evaluated once they have
+    not changed for debounce_time seconds. It is then evaluated in a
+    background thread, so the animation keeps playing, and the new data is
+    swapped into the existing artists when it is ready. Before that, a low
+    resolution preview, with a uniform time step of preview_time_step_size
+    and no waveform on the bottom plane, is evaluated and swapped in. The
+    preview plays at least once before the full data replaces it.
+
+    Usage:
+    fig = P.figure(figsize=(5,5))
+    explorer = BBHExplorer(fig, q, chiA, chiB)
+    explorer.update(q_new, chiA_new, chiB_new)  # for eg. in a slider callback
+    """
+
+    def __init__(self, fig, q, chiA, chiB, omega_ref=None, \
+            debounce_time=0.5, preview_time_step_size=20, \
+            rescale_fig_for_widgets=True, draw_full_trajectory=False, \
+            project_on_all_planes=False, no_freeze_near_merger=False, \
+            use_spin_angular_momentum_for_arrows=False):
+        """ preview_time_step_size: time step (in M) of the preview. If
+            None, there is no preview.
+        Other options are as for BBH_animation. The initial binary q, chiA,
+        chiB is evaluated at full resolution before returning.
+        """
+        self.omega_ref = omega_ref
+        self.debounce_time = debounce_time
+        self.preview_time_step_size = preview_time_step_size
+        self.no_freeze_near_merger = no_freeze_near_merger
+        self.update_options = {
+            'draw_full_trajectory': draw_full_trajectory,
+            'project_on_all_planes': project_on_all_planes,
+            'no_freeze_near_merger': no_freeze_near_merger,
+            'use_Kerr': not use_spin_angular_momentum_for_arrows,
+            }
+
+        self.fit_name = 'surfinBH7dq2'
+        self.nr_sur = load_NRSur7dq2()
+        self.fit = load_fit(self.fit_name)
+
+        # _lock protects the request counter, the timer and the queue of
+        # pending (request_id, data, preview, status) updates. _eval_lock
+        # makes sure only one thread evaluates the models at a time.
+        self._lock = threading.Lock()
+        self._eval_lock = threading.Lock()
+        self._timer = None
+        self._request_id = 0
+        self._pending = []
+
+        data = self._get_data(q, chiA, chiB, preview=False)
+        self.artists = draw_animation_artists(fig, data, \
+            rescale_fig_for_widgets=rescale_fig_for_widgets, \
+            fit_name=self.fit_name)
+        self.status_text = self.artists['ax'].text2D(0.6, 0.95, '', \
+            transform=self.artists['ax'].transAxes, \
+            color=colors_dict['info'], zorder=zorder_dict['notice_text'])
+        self._swap(data, preview=False)
+
+        self.line_ani = animation.FuncAnimation(fig, self._update_lines, \
+            self._iter_frames, interval=50, blit=False, repeat=True, \
+            save_count=len(self.frames))
+
+    def _get_data(self, q, chiA, chiB, preview):
+        if preview:
+            return get_animation_data(q, chiA, chiB, \
+                omega_ref=self.omega_ref, \
+                uniform_time_step_size=self.preview_time_step_size, \
+                dt_remnant=100, nr_sur=self.nr_sur, fit=self.fit)
+        return get_animation_data(q, chiA, chiB, omega_ref=self.omega_ref, \
+            nr_sur=self.nr_sur, fit=self.fit)
+
+    def _swap(self, data, preview):
+        """ Points the animation to data. Must be called from the thread
+        that draws the figure.
+        """
+        frames, hist_frames = get_animation_frames(data, \
+            no_freeze_near_merger=self.no_freeze_near_merger)
+        self.frames = list(frames)
+        self.fargs = get_update_fargs(data, self.artists, hist_frames, \
+            no_wave_planes=preview, **self.update_options)
+
+        set_animation_ranges(self.artists['ax'], self.artists['hax'], data)
+        self.artists['hax'].set_xlim(data['t_binary'][0], \
+            data['t_binary'][-1])
+        self.status_text.set_text('Preview' if preview else '')
+
+    def _update_lines(self, num):
+        return update_lines(num, *self.fargs)
+
+    def _iter_frames(self):
+        """ Frame numbers, restarting from the first frame whenever new data
+        has been swapped in. The full data of a request is only swapped in
+        once its preview has played through.
+        """
+        pos = 0
+        shown_id = None
+        preview_done = True
+        while True:
+            if pos >= len(self.frames):
+                pos = 0
+                preview_done = True
+            with self._lock:
+                # Updates of outdated requests are dropped
+                self._pending = [item for item in self._pending \
+                    if item[0] == self._request_id]
+                item = None
+                if len(self._pending) > 0:
+                    request_id, data, _, _ = self._pending[0]
+                    if preview_done or request_id != shown_id \
+                            or data is None:
+                        item = self._pending.pop(0)
+            if item is not None:
+                request_id, data, preview, status = item
+                if data is None:
+                    self.status_text.set_text(status)
+                else:
+                    self._swap(data, preview)
+                    shown_id = request_id
+                    preview_done = not preview
+                    pos = 0
+            yield self.frames[pos]
+            pos += 1
+
+    def _post(self, request_id, data, preview, status=None):
+        """ Queues data, or a new status text if data is None, for the
+        animation, unless newer parameters have come in meanwhile.
+        """
+        with self._lock:
+            if request_id != self._request_id:
+                return False
+            self._pending.append((request_id, data, preview, status))
+            return True
+
+    def _evaluate(self, request_id, q, chiA, chiB):
+        """ Evaluates and posts the preview and then the full data in the
+        background, unless newer parameters have come in meanwhile.
+        """
+        passes = [False]
+        if self.preview_time_step_size is not None:
+            passes = [True, False]
+        for preview in passes:
+            with self._eval_lock:
+                if request_id != self._request_id:
+                    return
+                try:
+                    data = self._get_data(q, chiA, chiB, preview)
+                except Exception:
+                    self._post(request_id, None, preview, \
+                        status='Evaluation failed')
+                    return
+            if not self._post(request_id, data, preview):
+                return
+
+    def update(self, q, chiA, chiB):
+        """ Shows the binary q, chiA, chiB once the parameters have not
+        changed for debounce_time seconds.
+        """
+        with self._lock:
+            self._request_id += 1
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.debounce_time, \
+                self._evaluate, args=(self._request_id, q, chiA, chiB))
+            self._timer.daemon = True
+            self._timer.start()
+        self.status_text.set_text('Updating...')
+
+#----------------------------------------------------------------------------
+def BBH_beaming_animation(fig, q, chiA, chiB, omega_ref=None, \
+        omega_start=None, uniform_time_step_size=None, num_theta=45, \
+        num_phi=90, still_time=None, save_file=None, \
+        no_surrogate_label=False):
+    """ Animates the beaming pattern of the gravitational waves, i.e. |h| on
+    the full sky, in a mollweide projection. The map at each frame is
+    normalized by its maximum over the sky.
+    """
+    chiA = np.array(chiA)
+    chiB = np.array(chiB)
+    t_binary, _, _, _, h_nrsur, _, _, _ = get_binary_data(q, chiA, chiB, \
+        omega_ref, omega_start=omega_start, \
+        uniform_time_step_size=uniform_time_step_size)
+
+    th, ph, cos_th_edges, ph_edges = get_equal_area_sky_grid(num_theta, \
+        num_phi)
+    h_sky = get_waveform_on_sky(h_nrsur, th, ph)
+
+    amp_sky = np.abs(h_sky)
+    amp_sky /= np.max(amp_sky, axis=0)
+
+    if LOW_DEF:
+        time_fontsize = 7
+    else:
+        time_fontsize = 12
+
+    ax = fig.add_subplot(111, projection='mollweide')
+    lat_edges = np.pi/2 - np.arccos(cos_th_edges)
+    mesh = ax.pcolormesh(ph_edges, lat_edges, \
+        amp_sky[:,0].reshape(num_theta, num_phi), cmap=cm.magma, \
+        vmin=0, vmax=1)
+    fig.colorbar(mesh, ax=ax, orientation='horizontal', pad=0.05, \
+        label='$|h|/\mathrm{max}|h|$')
+    ax.set_xticklabels([])
+    ax.grid(True)
+    time_text = fig.text(0.03, 0.05, '', fontsize=time_fontsize)
+
+    if not no_surrogate_label:
+        ax.set_title('NRSur7dq2', fontsize=time_fontsize)
+
+    def update_map(num):
+        mesh.set_array(amp_sky[:,num])
+        time_text.set_text('$t=%.1f\,M$'%t_binary[num])
+        return mesh, time_text
+
+    # save still and exit
+    if still_time is not None:
+        time_tag = '%d'%(abs(still_time))
+        if still_time < 0:
+            time_tag = 'm%s'%time_tag
+        update_map(np.argmin(np.abs(t_binary-still_time)))
+        still_fnametag = '%s_%s'%(save_file.split('.')[0], time_tag)
+        P.savefig('%s.png'%still_fnametag, bbox_inches='tight')
+        P.savefig('%s.pdf'%still_fnametag, bbox_inches='tight')
+        exit()
+
+    line_ani = animation.FuncAnimation(fig, update_map, range(len(t_binary)), \
+        interval=50, blit=False, repeat=True, repeat_delay=5e3)
+
+    return line_ani
+
 class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter, \
         argparse.RawDescriptionHelpFormatter):
     pass
@@ -1119,8 +1568,24 @@ if __name__ == '__main__':
     pp_special.add_argument('--no_surrogate_label', default=False, \
         action='store_true', \
         help='Do not show the surrogate names in the figtext.')
+    pp_special.add_argument('--beaming_pattern', default=False, \
+        action='store_true', \
+        help='Instead of the binary, show a movie of the beaming pattern ' \
+        'of the waveform, |h| over the full sky in a mollweide projection.')
+    pp_special.add_argument('--model_server', type=str, default=None, \
+        help='Unix socket of a running model_server.py, which evaluates ' \
+        'NRSur7dq2 and surfinBH instead of loading them in this process. ' \
+        'Default: the environment variable BBH_MODEL_SERVER.')
+    pp_special.add_argument('--remnant_table', type=str, default=None, \
+        help='Remnant lookup table written by remnant_table.py, used ' \
+        'instead of evaluating surfinBH7dq2 where possible. ' \
+        'Default: the environment variable BBH_REMNANT_TABLE.')
 
     args = parser.parse_args()
+    if args.model_server is not None:
+        MODEL_SERVER = args.model_server
+    if args.remnant_table is not None:
+        REMNANT_TABLE = args.remnant_table
     if args.height_map or args.auto_rotate_camera:
         args.project_on_all_planes=False
 
@@ -1128,28 +1593,39 @@ if __name__ == '__main__':
     if LOW_DEF:
         fig = P.figure(figsize=(2.3,2))
     else:
-        if args.no_wave_time_series:
+        if args.beaming_pattern:
+            fig = P.figure(figsize=(6,4))
+        elif args.no_wave_time_series:
             fig = P.figure(figsize=(5,4))
         else:
             fig = P.figure(figsize=(5,5.5))
 
 
-    line_ani = BBH_animation(fig, args.q, args.chiA, args.chiB,
-        omega_ref = args.omega_ref,
-        draw_full_trajectory = args.draw_full_trajectory,
-        height_map = args.height_map,
-        project_on_all_planes = args.project_on_all_planes,
-        auto_rotate_camera = args.auto_rotate_camera,
-        save_file = args.save_file,
-        no_freeze_near_merger = args.no_freeze_near_merger,
-        omega_start = args.omega_start,
-        no_wave_time_series = args.no_wave_time_series,
-        uniform_time_step_size = args.uniform_time_step_size,
-        still_time = args.still_time,
-        no_time_label = args.no_time_label,
-        no_surrogate_label = args.no_surrogate_label,
-        use_spin_angular_momentum_for_arrows \
-                = args.use_spin_angular_momentum_for_arrows)
+    if args.beaming_pattern:
+        line_ani = BBH_beaming_animation(fig, args.q, args.chiA, args.chiB,
+            omega_ref = args.omega_ref,
+            omega_start = args.omega_start,
+            uniform_time_step_size = args.uniform_time_step_size,
+            still_time = args.still_time,
+            save_file = args.save_file,
+            no_surrogate_label = args.no_surrogate_label)
+    else:
+        line_ani = BBH_animation(fig, args.q, args.chiA, args.chiB,
+            omega_ref = args.omega_ref,
+            draw_full_trajectory = args.draw_full_trajectory,
+            height_map = args.height_map,
+            project_on_all_planes = args.project_on_all_planes,
+            auto_rotate_camera = args.auto_rotate_camera,
+            save_file = args.save_file,
+            no_freeze_near_merger = args.no_freeze_near_merger,
+            omega_start = args.omega_start,
+            no_wave_time_series = args.no_wave_time_series,
+            uniform_time_step_size = args.uniform_time_step_size,
+            still_time = args.still_time,
+            no_time_label = args.no_time_label,
+            no_surrogate_label = args.no_surrogate_label,
+            use_spin_angular_momentum_for_arrows \
+                    = args.use_spin_angular_momentum_for_arrows)
 
     if args.save_file is not None:
         # Set up formatting for the movie files
@@ -0,0 +1,508 @@
+#!/usr/bin/env python
+
+__doc__ = """eob_training
+============
+
+Generates the EOBNRv2 training set for the 1D surrogate built in
+ICERM-build-1d-model.ipynb.
+
+The waveforms are evaluated with the LALDict-era interface of
+lalsimulation, as in the lalsuite of environment.yml. The LAL calls are
+farmed out over a process pool, and each finished waveform can be
+checkpointed to disk so that an interrupted run resumes where it stopped.
+
+The training set is stored as a ragged array in HDF5: all waveforms are
+concatenated into one contiguous complex buffer, along with offsets into
+it and the mass ratios. TrainingSet memory-maps the buffer, so single
+waveforms or time windows can be read without loading the whole set.
+
+With --all_modes, all the modes of EOBNRv2HM are generated by a single
+call per mass ratio, instead of one call (and one solve of the EOB
+dynamics) per mode. The modes share a time grid, so they are stored
+together, one buffer per mode with common offsets.
+
+Example usage:
+./eob_training.py --num_samples 100 --num_procs 4 --checkpoint_dir ckpt
+"""
+
+import numpy as np
+import os
+import argparse
+import h5py
+import hashlib
+import json
+from multiprocessing import Pool
+
+have_lal = False
+try:
+    import lal
+    import lalsimulation as LS
+    have_lal = True
+except ImportError:
+    print("lal/lalsimulation not found, only pre-made training data can be" \
+        + " used.")
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), \
+    'data', '1D_EOBNRv2')
+HM_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), \
+    'data', '1D_EOBNRv2HM')
+
+
+#----------------------------------------------------------------------------
+def Mq_to_m1m2(M, q):
+    """Convert total mass, mass ratio pair to m1, m2"""
+    m2 = M/(1.+q)
+    m1 = M-m2
+    return m1, m2
+
+#----------------------------------------------------------------------------
+def EOBNRv2_LAL_modes(Mtot=80.0, q=1.0, dt=1.0/2048., fmin=10.0, Dist=1.0, \
+        ell=2, emm=2):
+    """ Simplified inferface to EOBNRv2 mode.
+
+        INPUT
+        =====
+        Dist -- distance in megaparsecs.
+        Mtot -- total mass in solar masses"""
+
+    if not have_lal:
+        raise Exception('lal and lalsimulation are needed to evaluate EOBNRv2')
+
+    Dist = Dist * 1e6 *lal.PC_SI
+    Mtot = Mtot * lal.MSUN_SI
+
+    M1, M2 = Mq_to_m1m2(Mtot, q)
+
+    # phiRef, deltaT, m1, m2, S1x, S1y, S1z, S2x, S2y, S2z, f_min, f_ref,
+    # r, LALpars, l, m, approximant
+    h = LS.SimInspiralChooseTDMode(0.0, dt, M1, M2, 0.0, 0.0, 0.0, 0.0, \
+        0.0, 0.0, fmin, 0.0, Dist, None, ell, emm, LS.EOBNRv2)
+
+    times = np.arange(np.size(h.data.data))*h.deltaT
+
+    return times, h.data.data
+
+#----------------------------------------------------------------------------
+def SEOBNRv4_LAL(Mtot=80.0, q=1.0, chi1z=0.0, chi2z=0.0, dt=1.0/2048., \
+        fmin=10.0, Dist=1.0):
+    """ Simplified inferface to the aligned-spin SEOBNRv4 model, for the
+    surrogates of surrogate_nd. Returns h = h_+ - i h_x seen face-on, which
+    is proportional to the (2,2) mode.
+
+        INPUT
+        =====
+        Dist -- distance in megaparsecs.
+        Mtot -- total mass in solar masses
+        chi1z, chi2z -- dimensionless spins along the orbital angular
+                        momentum, of the heavier and lighter black hole"""
+
+    if not have_lal:
+        raise Exception('lal and lalsimulation are needed to evaluate ' \
+            'SEOBNRv4')
+
+    Dist = Dist * 1e6 *lal.PC_SI
+    Mtot = Mtot * lal.MSUN_SI
+
+    M1, M2 = Mq_to_m1m2(Mtot, q)
+
+    # m1, m2, S1x, S1y, S1z, S2x, S2y, S2z, distance, inclination, phiRef,
+    # longAscNodes, eccentricity, meanPerAno, deltaT, f_min, f_ref,
+    # LALparams, approximant
+    hp, hc = LS.SimInspiralChooseTDWaveform(M1, M2, 0.0, 0.0, chi1z, \
+        0.0, 0.0, chi2z, Dist, 0.0, 0.0, 0.0, 0.0, 0.0, dt, fmin, fmin, \
+        None, LS.SEOBNRv4)
+
+    times = np.arange(np.size(hp.data.data))*hp.deltaT
+
+    return times, hp.data.data - 1j*hc.data.data
+
+#----------------------------------------------------------------------------
+def EOBNRv2HM_LAL_modes(Mtot=80.0, q=1.0, dt=1.0/2048., fmin=10.0, \
+        Dist=1.0, lmax=5):
+    """ Simplified inferface to all the modes of EOBNRv2HM, from a single
+    solve of the EOB dynamics.
+
+        INPUT
+        =====
+        Dist -- distance in megaparsecs.
+        Mtot -- total mass in solar masses
+        lmax -- largest ell of the modes to return
+
+        OUTPUT
+        ======
+        times, and a dict of the modes keyed by (ell, emm)"""
+
+    if not have_lal:
+        raise Exception('lal and lalsimulation are needed to evaluate ' \
+            'EOBNRv2HM')
+
+    Dist = Dist * 1e6 *lal.PC_SI
+    Mtot = Mtot * lal.MSUN_SI
+
+    M1, M2 = Mq_to_m1m2(Mtot, q)
+
+    # phiRef, deltaT, m1, m2, S1x, S1y, S1z, S2x, S2y, S2z, f_min, f_ref,
+    # r, LALpars, lmax, approximant
+    hlms = LS.SimInspiralChooseTDModes(0.0, dt, M1, M2, 0.0, 0.0, 0.0, 0.0, \
+        0.0, 0.0, fmin, 0.0, Dist, None, lmax, LS.EOBNRv2HM)
+
+    # Linked list of the modes
+    modes = {}
+    hlm = hlms
+    while hlm is not None:
+        modes[(hlm.l, hlm.m)] = hlm.mode.data.data
+        times = np.arange(np.size(hlm.mode.data.data))*hlm.mode.deltaT
+        hlm = hlm.next
+
+    return times, modes
+
+#----------------------------------------------------------------------------
+def get_mode_name(ell, emm):
+    """ Name of the (ell, emm) mode in training set and surrogate files.
+    """
+    return 'l%d_m%d'%(ell, emm)
+
+#----------------------------------------------------------------------------
+def get_checkpoint_file(checkpoint_dir, idx, q, eob_kwargs, all_modes=False):
+    """ File in which the idx-th training waveform, with mass ratio q, is
+    checkpointed. The name includes a hash of all the parameters, so that
+    waveforms generated with other settings are never reused.
+    """
+    key = _cache_key(q, dict(eob_kwargs, all_modes=all_modes))
+    ext = 'npz' if all_modes else 'npy'
+    return os.path.join(checkpoint_dir, 'h_%06d_%s.%s'%(idx, key, ext))
+
+#----------------------------------------------------------------------------
+def _generate_training_waveform(args):
+    """ Worker for generate_training_set. Returns the checkpointed waveform
+    if it exists, else evaluates EOBNRv2 and checkpoints the result.
+    """
+    idx, q, eob_kwargs, checkpoint_dir, all_modes = args
+
+    if checkpoint_dir is not None:
+        fname = get_checkpoint_file(checkpoint_dir, idx, q, eob_kwargs, \
+            all_modes=all_modes)
+        if os.path.exists(fname):
+            if all_modes:
+                with np.load(fname) as f:
+                    return dict(((int(ell), int(emm)), f['h_%d'%i]) \
+                        for i, (ell, emm) in enumerate(f['modes']))
+            return np.load(fname)
+
+    if all_modes:
+        t, h = EOBNRv2HM_LAL_modes(q=q, **eob_kwargs)
+    else:
+        t, h = EOBNRv2_LAL_modes(q=q, **eob_kwargs)
+
+    if checkpoint_dir is not None:
+        # Write to a temporary file first, so that an interrupted write
+        # never leaves behind a truncated checkpoint.
+        tmp_fname = '%s.tmp%s'%os.path.splitext(fname)
+        if all_modes:
+            modes = sorted(h.keys())
+            arrays = dict(('h_%d'%i, h[mode]) for i, mode in enumerate(modes))
+            np.savez(tmp_fname, modes=np.array(modes), **arrays)
+        else:
+            np.save(tmp_fname, h)
+        os.replace(tmp_fname, fname)
+
+    return h
+
+#----------------------------------------------------------------------------
+def generate_training_set(qs, num_procs=None, checkpoint_dir=None, \
+        verbose=False, all_modes=False, **eob_kwargs):
+    """ Evaluates EOBNRv2_LAL_modes at each mass ratio in qs, in parallel.
+
+    qs: mass ratios of the training set.
+    num_procs: number of worker processes. Default: number of cores.
+    checkpoint_dir: If given, each finished waveform is saved here, and
+        waveforms that were already saved with the same parameters are
+        loaded instead of being regenerated.
+    all_modes: If True, evaluates EOBNRv2HM_LAL_modes instead, and each
+        waveform is a dict of modes keyed by (ell, emm).
+    eob_kwargs: passed on to EOBNRv2_LAL_modes, for eg. Mtot, dt, fmin.
+
+    Returns the training data as a list of complex waveforms, in the same
+    order as qs.
+    """
+    if checkpoint_dir is not None and not os.path.isdir(checkpoint_dir):
+        os.makedirs(checkpoint_dir)
+
+    tasks = [(idx, q, eob_kwargs, checkpoint_dir, all_modes) \
+        for idx, q in enumerate(qs)]
+
+    training_data = []
+    with Pool(num_procs) as pool:
+        # imap keeps the ordering of qs, regardless of which worker
+        # finishes first.
+        for idx, h in enumerate(pool.imap(_generate_training_waveform, \
+                tasks)):
+            training_data.append(h)
+            if verbose:
+                length = len(next(iter(h.values()))) if all_modes else len(h)
+                print('Waveform %i with q = %f has length %i'%(idx, \
+                    qs[idx], length))
+
+    return training_data
+
+#----------------------------------------------------------------------------
+def _cache_key(q, eob_kwargs):
+    """ Key of the waveform cache and checkpoints for
+    EOBNRv2_LAL_modes(q=q, **eob_kwargs).
+    """
+    params = dict(eob_kwargs, q=float(q))
+    params = json.dumps(params, sort_keys=True).encode('ascii')
+    return hashlib.sha1(params).hexdigest()
+
+#----------------------------------------------------------------------------
+def _cache_waveform(args):
+    """ Worker for WaveformCache.get_many.
+    """
+    fname, q, eob_kwargs = args
+    t, h = EOBNRv2_LAL_modes(q=q, **eob_kwargs)
+    tmp_fname = '%s.tmp.npy'%fname[:-4]
+    np.save(tmp_fname, h)
+    os.replace(tmp_fname, fname)
+    return h
+
+#----------------------------------------------------------------------------
+class WaveformCache(object):
+    """ On-disk cache of EOBNRv2 waveforms, keyed by all the parameters
+    passed to EOBNRv2_LAL_modes. Meant for reference waveforms, for eg.
+    for validating surrogates, that are needed again and again.
+
+    Usage:
+    cache = WaveformCache('eob_cache')
+    h = cache.get(1.37, Mtot=80.0, dt=1.0/2048., fmin=10.0)
+    hs = cache.get_many(qs, num_procs=8, Mtot=80.0, dt=1.0/2048., fmin=10.0)
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def get_file(self, q, **eob_kwargs):
+        return os.path.join(self.cache_dir, '%s.npy'%_cache_key(q, \
+            eob_kwargs))
+
+    def get(self, q, **eob_kwargs):
+        """ Waveform at q, evaluated and cached if not already cached.
+        """
+        return self.get_many([q], num_procs=1, **eob_kwargs)[0]
+
+    def get_many(self, qs, num_procs=None, **eob_kwargs):
+        """ Waveforms at each q in qs. The ones that are not cached are
+        evaluated in parallel over num_procs processes.
+        """
+        fnames = [self.get_file(q, **eob_kwargs) for q in qs]
+        missing = [(fname, q, eob_kwargs) for fname, q in zip(fnames, qs) \
+            if not os.path.exists(fname)]
+
+        if len(missing) == 1 or num_procs == 1:
+            for task in missing:
+                _cache_waveform(task)
+        elif len(missing) > 1:
+            with Pool(num_procs) as pool:
+                pool.map(_cache_waveform, missing)
+
+        return [np.load(fname) for fname in fnames]
+
+#----------------------------------------------------------------------------
+def write_training_set(filename, qs, training_data, **attrs):
+    """ Writes a ragged training set to an HDF5 file.
+
+    qs: mass ratios of the training set.
+    training_data: list of complex waveforms, possibly of different lengths,
+        or list of dicts of modes keyed by (ell, emm), as returned by
+        generate_training_set with all_modes=True.
+    attrs: metadata stored as attributes of the file, for eg. dt, Mtot.
+
+    The waveforms are written one at a time into a single contiguous
+    dataset 'data'. Waveform i is data[offsets[i]:offsets[i+1]]. For
+    multiple modes, each mode has its own dataset 'data_l2_m2' etc., with
+    the same offsets, and the modes are listed in the dataset 'modes'.
+    """
+    all_modes = len(training_data) > 0 and isinstance(training_data[0], dict)
+    if all_modes:
+        modes = sorted(training_data[0].keys())
+        lengths = np.array([len(h[modes[0]]) for h in training_data], \
+            dtype=np.int64)
+    else:
+        lengths = np.array([len(h) for h in training_data], dtype=np.int64)
+    offsets = np.append(0, np.cumsum(lengths))
+
+    with h5py.File(filename, 'w') as f:
+        f.create_dataset('q', data=np.asarray(qs, dtype=float))
+        f.create_dataset('offsets', data=offsets)
+        # No chunking or compression, so that TrainingSet can memory-map it
+        if all_modes:
+            f.create_dataset('modes', data=np.array(modes, dtype=np.int64))
+            for mode in modes:
+                data = f.create_dataset('data_%s'%get_mode_name(*mode), \
+                    shape=(offsets[-1],), dtype=np.complex128)
+                for idx, h in enumerate(training_data):
+                    if len(h[mode]) != lengths[idx]:
+                        raise Exception('The modes of waveform %d have ' \
+                            'different lengths'%idx)
+                    data[offsets[idx]:offsets[idx+1]] = h[mode]
+        else:
+            data = f.create_dataset('data', shape=(offsets[-1],), \
+                dtype=np.complex128)
+            for idx, h in enumerate(training_data):
+                data[offsets[idx]:offsets[idx+1]] = h
+        for key in attrs.keys():
+            f.attrs[key] = attrs[key]
+
+#----------------------------------------------------------------------------
+class TrainingSet(object):
+    """ Read-only view of a training set written by write_training_set.
+
+    The waveform buffer is memory-mapped, so nothing is read from disk
+    until a waveform is accessed.
+
+    Usage:
+    training_set = TrainingSet('data/1D_EOBNRv2/training_data.h5')
+    qs = training_set.qs
+    h = training_set[3]                     # 4th waveform
+    h_late = training_set.get_waveform(3, t_start=3.0)   # t >= 3 sec
+    training_data = list(training_set)      # all waveforms
+
+    For a training set with all modes, the mode to read must be given:
+    training_set = TrainingSet('training_data_HM.h5', mode=(3, 3))
+    training_set.modes                      # all modes in the file
+    """
+
+    def __init__(self, filename, mode=None):
+        self.filename = filename
+        self.mode = mode
+        with h5py.File(filename, 'r') as f:
+            self.qs = f['q'][()]
+            self.offsets = f['offsets'][()]
+            self.attrs = dict(f.attrs)
+            if 'modes' in f:
+                self.modes = [(int(ell), int(emm)) \
+                    for ell, emm in f['modes'][()]]
+            else:
+                self.modes = None
+
+            if mode is None:
+                if self.modes is not None:
+                    raise Exception('%s has several modes, choose one of ' \
+                        '%s'%(filename, self.modes))
+                data = f['data']
+            else:
+                if self.modes is None or tuple(mode) not in self.modes:
+                    raise Exception('%s has no mode %s'%(filename, mode))
+                data = f['data_%s'%get_mode_name(*mode)]
+            data_offset = data.id.get_offset()
+            data_dtype = data.dtype
+            data_shape = data.shape
+
+        if data_offset is None:
+            # Nothing was ever written to the buffer
+            self.data = np.zeros(data_shape, dtype=data_dtype)
+        else:
+            self.data = np.memmap(filename, mode='r', dtype=data_dtype, \
+                offset=data_offset, shape=data_shape)
+
+    def __len__(self):
+        return len(self.qs)
+
+    def __getitem__(self, idx):
+        return self.data[self.offsets[idx]:self.offsets[idx+1]]
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def lengths(self):
+        """ Number of samples in each waveform. """
+        return np.diff(self.offsets)
+
+    def get_waveform(self, idx, t_start=None, t_end=None):
+        """ Returns the samples of the idx-th waveform with
+        t_start <= t < t_end, where t = 0 at the first sample. Requires the
+        time step, 'dt', in the metadata.
+        """
+        h = self[idx]
+        dt = self.attrs['dt']
+        start = 0 if t_start is None else int(np.ceil(t_start/dt - 1e-8))
+        end = len(h) if t_end is None else int(np.ceil(t_end/dt - 1e-8))
+        return h[max(start, 0):max(end, 0)]
+
+#----------------------------------------------------------------------------
+def convert_npy_training_data(npy_file, q_file, out_file, **attrs):
+    """ Converts the old pickled object array training_data.npy, along with
+    the mass ratios in q_file, to the format of write_training_set.
+    """
+    training_data = np.load(npy_file, allow_pickle=True, encoding='bytes')
+    qs = np.loadtxt(q_file)
+    write_training_set(out_file, qs, training_data, **attrs)
+
+#----------------------------------------------------------------------------
+def save_training_set(qs, training_data, data_dir=DATA_DIR, **attrs):
+    """ Saves the training set to data_dir: the mass ratios to
+    q_values_training.txt and the waveforms to training_data.h5.
+    """
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+
+    np.savetxt(os.path.join(data_dir, 'q_values_training.txt'), qs)
+    write_training_set(os.path.join(data_dir, 'training_data.h5'), qs, \
+        training_data, **attrs)
+
+
+#############################    main    ##################################
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('--num_samples', type=int, default=100,
+        help='Number of training samples, uniformly spaced in q.')
+    parser.add_argument('--q_min', type=float, default=1.0,
+        help='Smallest mass ratio of the training set.')
+    parser.add_argument('--q_max', type=float, default=2.0,
+        help='Largest mass ratio of the training set.')
+    parser.add_argument('--dt', type=float, default=1.0/2048.,
+        help='Time step in seconds.')
+    parser.add_argument('--num_procs', type=int, default=None,
+        help='Number of worker processes. Default: number of cores.')
+    parser.add_argument('--checkpoint_dir', type=str, default=None,
+        help='If given, each waveform is checkpointed here, and a rerun ' \
+            'resumes from the checkpointed waveforms.')
+    parser.add_argument('--all_modes', default=False, action='store_true',
+        help='Generate all modes of EOBNRv2HM, up to --lmax, with one call ' \
+            'per mass ratio.')
+    parser.add_argument('--lmax', type=int, default=5,
+        help='Largest ell of the modes, with --all_modes.')
+    parser.add_argument('--data_dir', type=str, default=None,
+        help='Directory to save the training set to. Default: ' \
+            'data/1D_EOBNRv2, or data/1D_EOBNRv2HM with --all_modes.')
+    parser.add_argument('--convert_npy', type=str, default=None,
+        help='Instead of generating waveforms, convert this pickled ' \
+            'training_data.npy (with q_values_training.txt from data_dir) ' \
+            'to training_data.h5 in data_dir.')
+
+    args = parser.parse_args()
+    if args.data_dir is None:
+        args.data_dir = HM_DATA_DIR if args.all_modes else DATA_DIR
+
+    if args.convert_npy is not None:
+        convert_npy_training_data(args.convert_npy, \
+            os.path.join(args.data_dir, 'q_values_training.txt'), \
+            os.path.join(args.data_dir, 'training_data.h5'), dt=args.dt)
+    else:
+        qs = np.linspace(args.q_min, args.q_max, args.num_samples)
+        if args.all_modes:
+            eob_kwargs = dict(Mtot=80.0, dt=args.dt, fmin=10.0, Dist=1.0, \
+                lmax=args.lmax)
+        else:
+            eob_kwargs = dict(Mtot=80.0, dt=args.dt, fmin=10.0, Dist=1.0, \
+                ell=2, emm=2)
+        training_data = generate_training_set(qs, num_procs=args.num_procs, \
+            checkpoint_dir=args.checkpoint_dir, verbose=True, \
+            all_modes=args.all_modes, **eob_kwargs)
+        save_training_set(qs, training_data, data_dir=args.data_dir, \
+            **eob_kwargs)
@@ -0,0 +1,216 @@
+__doc__ = """gwsurrogate_cache
+=================
+
+Memoizing wrapper around a surrogate loaded with gwsurrogate.LoadSurrogate,
+for the repeated calls of gwsurrogate.ipynb that only change M, dist_mpc,
+inclination, phi_ref or units.
+
+The surrogate is always evaluated in dimensionless units, and the modes and
+dynamics are cached, keyed on the intrinsic parameters (q, chiA, chiB) and
+the dimensionless sampling settings (dt, f_low and f_ref in units of M,
+ellMax, and any other options). The cache is LRU, bounded by the total
+memory of the cached arrays. The extrinsic parameters are applied on top of
+the cached modes: the rescaling to physical units by M and dist_mpc, and
+the sum over modes with spin-weighted spherical harmonics for a point on
+the sky.
+
+In physical units, dt, f_low and f_ref are in seconds and Hz, so in units
+of M they change with M. With f_low = f_ref = 0, mass scans can still hit
+the cache if resample_dt is given: the surrogate is then always evaluated
+with that time step (in M), and the modes and dynamics are interpolated to
+the requested time step. The interpolation is cubic in the amplitude and
+phase of the modes, so resample_dt should be no larger than the smallest
+requested time step.
+
+Usage:
+sur = gwsurrogate.LoadSurrogate('NRSur7dq4')
+cached_sur = CachedSurrogate(sur, max_bytes=2e9)
+for dist_mpc in [100, 200, 400]:
+    t, h, dyn = cached_sur(q, chiA, chiB, dt=1./4096, f_low=0, f_ref=20,
+        M=70, dist_mpc=dist_mpc, units='mks', inclination=np.pi/4,
+        phi_ref=np.pi/5)
+print(cached_sur.hits, cached_sur.misses)
+"""
+
+import numpy as np
+from collections import OrderedDict
+from scipy.interpolate import CubicSpline
+
+from gwsurrogate.harmonics import sYlm
+
+# Same values as in lal
+MTSUN_SI = 4.925491025543576e-06       # G MSun/c^3 in seconds
+MRSUN_SI = 1476.6250614046494          # G MSun/c^2 in meters
+PC_SI = 3.085677581491367e+16          # parsec in meters
+
+
+#----------------------------------------------------------------------------
+def _freeze(value):
+    """ Hashable version of value, for the cache keys.
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(value[key])) for key in value))
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return tuple(_freeze(val) for val in value)
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+#----------------------------------------------------------------------------
+def _get_nbytes(entry):
+    """ Memory of the arrays of a cache entry.
+    """
+    t, h, dyn = entry
+    nbytes = np.asarray(t).nbytes
+    nbytes += sum(np.asarray(h[mode]).nbytes for mode in h)
+    if dyn is not None:
+        nbytes += sum(np.asarray(dyn[key]).nbytes for key in dyn)
+    return nbytes
+
+#----------------------------------------------------------------------------
+def resample_modes(t, h, t_new):
+    """ Cubic spline interpolation of the amplitude and unwrapped phase of
+    each mode in h from t to t_new.
+    """
+    h_new = {}
+    for mode in h:
+        amp = CubicSpline(t, np.abs(h[mode]))(t_new)
+        phase = CubicSpline(t, np.unwrap(np.angle(h[mode])))(t_new)
+        h_new[mode] = amp*np.exp(1j*phase)
+    return h_new
+
+#----------------------------------------------------------------------------
+def resample_dynamics(t, dyn, t_new):
+    """ Cubic spline interpolation of the dynamics from t to t_new, along
+    whichever axis (first or last) has the length of t. Other entries are
+    left as they are.
+    """
+    if dyn is None:
+        return None
+    dyn_new = {}
+    for key in dyn:
+        value = np.asarray(dyn[key])
+        if value.ndim > 0 and value.shape[0] == len(t):
+            dyn_new[key] = CubicSpline(t, value, axis=0)(t_new)
+        elif value.ndim > 0 and value.shape[-1] == len(t):
+            dyn_new[key] = CubicSpline(t, value, axis=-1)(t_new)
+        else:
+            dyn_new[key] = value
+    return dyn_new
+
+#----------------------------------------------------------------------------
+def sum_modes(h, inclination, phi_ref):
+    """ h_+ - i h_x = sum_lm h_lm sYlm(-2, ell, m, inclination,
+    pi/2 - phi_ref), in the convention of gwsurrogate.
+
+    Models with orbital-plane symmetry, for eg. aligned-spin ones, may only
+    return the m >= 0 modes. The missing m < 0 modes are then filled in
+    with h_l,-m = (-1)^l conj(h_lm).
+    """
+    h = dict(h)
+    for (ell, m) in list(h.keys()):
+        if m > 0 and (ell, -m) not in h:
+            h[(ell, -m)] = (-1)**ell*np.conj(h[(ell, m)])
+
+    h_sum = 0
+    for (ell, m) in h:
+        h_sum = h_sum + h[(ell, m)]*sYlm(-2, ell, m, inclination, \
+            np.pi/2 - phi_ref)
+    return h_sum
+
+#----------------------------------------------------------------------------
+class CachedSurrogate(object):
+    """ Memoizing wrapper around a gwsurrogate surrogate, with the same call
+    signature. See the module documentation.
+
+    Attributes:
+    hits, misses: number of calls that were and were not in the cache.
+    nbytes: memory of the cached arrays.
+    """
+
+    def __init__(self, sur, max_bytes=1e9, resample_dt=None):
+        """ sur: surrogate loaded with gwsurrogate.LoadSurrogate.
+        max_bytes: bound on the memory of the cached arrays. The least
+            recently used entries are evicted beyond it.
+        resample_dt: If given, time step (in M) at which the surrogate is
+            always evaluated, see the module documentation.
+        """
+        self.sur = sur
+        self.max_bytes = max_bytes
+        self.resample_dt = resample_dt
+        self.cache = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self.cache.clear()
+        self.nbytes = 0
+
+    def _get_entry(self, q, chiA, chiB, eval_kwargs):
+        """ Cached dimensionless (t, h, dyn), evaluating the surrogate with
+        eval_kwargs if needed.
+        """
+        key = _freeze((q, chiA, chiB, eval_kwargs))
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        self.misses += 1
+        entry = self.sur(q, chiA, chiB, units='dimensionless', **eval_kwargs)
+        entry_nbytes = _get_nbytes(entry)
+        if entry_nbytes <= self.max_bytes:
+            self.cache[key] = entry
+            self.nbytes += entry_nbytes
+            while self.nbytes > self.max_bytes:
+                old_key, old_entry = self.cache.popitem(last=False)
+                self.nbytes -= _get_nbytes(old_entry)
+        return entry
+
+    def __call__(self, q, chiA, chiB, dt=None, f_low=None, f_ref=None, \
+            ellMax=None, M=None, dist_mpc=None, inclination=None, \
+            phi_ref=0, units='dimensionless', **kwargs):
+        """ Same as calling the gwsurrogate surrogate, except that the time
+        samples can only be given by dt, not times. Other keyword arguments,
+        for eg. precessing_opts, are passed on to the surrogate and are
+        part of the cache key.
+        """
+        if 'times' in kwargs:
+            raise Exception('CachedSurrogate only supports dt, not times')
+
+        # Sampling settings in units of M
+        if units == 'mks':
+            if M is None or dist_mpc is None:
+                raise Exception('M and dist_mpc are needed for mks units')
+            time_scale = M*MTSUN_SI
+            amp_scale = M*MRSUN_SI/(dist_mpc*1e6*PC_SI)
+        elif units == 'dimensionless':
+            time_scale = 1
+            amp_scale = 1
+        else:
+            raise Exception('Unknown units %s'%units)
+        dt_M = None if dt is None else dt/time_scale
+        f_low_M = None if f_low is None else f_low*time_scale
+        f_ref_M = None if f_ref is None else f_ref*time_scale
+
+        eval_dt = dt_M if self.resample_dt is None else self.resample_dt
+        eval_kwargs = dict(kwargs, dt=eval_dt, f_low=f_low_M, f_ref=f_ref_M, \
+            ellMax=ellMax)
+        t, h, dyn = self._get_entry(q, chiA, chiB, eval_kwargs)
+
+        if self.resample_dt is not None and dt_M is not None \
+                and dt_M != self.resample_dt:
+            t_new = np.arange(t[0], t[-1], dt_M)
+            h = resample_modes(t, h, t_new)
+            dyn = resample_dynamics(t, dyn, t_new)
+            t = t_new
+        elif dyn is not None:
+            dyn = dict((key, np.copy(dyn[key])) for key in dyn)
+
+        t = t*time_scale
+        if inclination is not None:
+            h = amp_scale*sum_modes(h, inclination, phi_ref)
+        else:
+            h = dict((mode, amp_scale*h[mode]) for mode in h)
+        return t, h, dyn
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+__doc__ = """max_kick
+========
+
+Search for the largest remnant kick of a surfinBH fit, replacing the random
+search of Exercise 3 in surfinBH.ipynb.
+
+Local optimizations (Nelder-Mead, from scipy) of |vf| over the spin
+directions, and optionally the mass ratio, are started from random
+isotropic spin directions. The starts run in parallel over a process pool,
+in which each worker loads the fit once.
+
+Usage:
+result = search_max_kick(num_starts=16, num_procs=8)
+print(result['vfmag'], result['q'], result['chiA'], result['chiB'])
+
+Example usage:
+./max_kick.py --num_starts 32 --num_procs 8 --vary_q
+"""
+
+import numpy as np
+import argparse
+from multiprocessing import Pool
+from scipy.optimize import minimize
+import scipy.constants
+
+import surfinBH
+
+
+#----------------------------------------------------------------------------
+def angles_to_spin(chimag, theta, phi):
+    """ Spin vector with magnitude chimag, and polar and azimuthal angles
+    theta and phi.
+    """
+    return chimag*np.array([np.sin(theta)*np.cos(phi), \
+        np.sin(theta)*np.sin(phi), np.cos(theta)])
+
+#----------------------------------------------------------------------------
+# The fit and search settings of each worker, set by _init_worker.
+_worker_data = {}
+
+def _init_worker(fit_name, chimag, q, q_min, q_max, fit_kwargs):
+    _worker_data['fit'] = surfinBH.LoadFits(fit_name)
+    _worker_data['chimag'] = chimag
+    _worker_data['q'] = q
+    _worker_data['q_min'] = q_min
+    _worker_data['q_max'] = q_max
+    _worker_data['fit_kwargs'] = fit_kwargs
+
+#----------------------------------------------------------------------------
+def _kick_magnitude(q, chiA, chiB):
+    vf, vf_err = _worker_data['fit'].vf(q, chiA, chiB, \
+        **_worker_data['fit_kwargs'])
+    return np.linalg.norm(vf)
+
+#----------------------------------------------------------------------------
+def get_binary(x):
+    """ q, chiA, chiB for the optimization variables x = [thetaA, phiA,
+    thetaB, phiB] or [thetaA, phiA, thetaB, phiB, q]. q is clipped to
+    [q_min, q_max].
+    """
+    chimag = _worker_data['chimag']
+    chiA = angles_to_spin(chimag, x[0], x[1])
+    chiB = angles_to_spin(chimag, x[2], x[3])
+    if len(x) == 5:
+        q = np.clip(x[4], _worker_data['q_min'], _worker_data['q_max'])
+    else:
+        q = _worker_data['q']
+    return q, chiA, chiB
+
+#----------------------------------------------------------------------------
+def _negative_kick(x):
+    q, chiA, chiB = get_binary(x)
+    return -_kick_magnitude(q, chiA, chiB)
+
+#----------------------------------------------------------------------------
+def _run_start(args):
+    """ One local optimization from the start x0. Returns its best point,
+    the best |vf| after each iteration, and the number of fit.vf calls it
+    needed.
+    """
+    x0, options = args
+
+    # The best point after each iteration is the best one evaluated so far,
+    # so the history needs no extra fit.vf calls
+    values = []
+    def objective(x):
+        values.append(_negative_kick(x))
+        return values[-1]
+
+    history = []
+    def callback(x):
+        history.append(-min(values))
+
+    res = minimize(objective, x0, method='Nelder-Mead', \
+        callback=callback, options=options)
+    q, chiA, chiB = get_binary(res.x)
+    return {
+        'vfmag': -res.fun,
+        'q': float(q),
+        'chiA': chiA,
+        'chiB': chiB,
+        'history': np.array(history),
+        'num_fit_evals': len(values),
+        }
+
+#----------------------------------------------------------------------------
+def search_max_kick(fit_name='NRSur7dq4Remnant', num_starts=16, chimag=1, \
+        q=1, vary_q=False, q_min=1, q_max=4, num_procs=None, seed=None, \
+        options=None, fit_kwargs=None):
+    """ Multi-start search for the largest kick, over the spin directions
+    with fixed spin magnitudes chimag and, unless vary_q, fixed mass ratio q.
+
+    options: options of scipy.optimize.minimize for Nelder-Mead.
+    fit_kwargs: dict passed on to fit.vf, for eg. {'omega0': 7e-3}.
+
+    Returns a dict with the best binary (q, chiA, chiB, vfmag), the history
+    of the best start (the best |vf| after each iteration), the results of
+    all starts, and the total number of fit.vf evaluations.
+    """
+    if options is None:
+        options = {'xatol': 1e-6, 'fatol': 1e-8, 'maxiter': 2000}
+    if fit_kwargs is None:
+        fit_kwargs = {}
+
+    rng = np.random.RandomState(seed)
+    x0s = np.array([np.arccos(rng.uniform(-1, 1, num_starts)), \
+        rng.uniform(0, 2*np.pi, num_starts), \
+        np.arccos(rng.uniform(-1, 1, num_starts)), \
+        rng.uniform(0, 2*np.pi, num_starts)]).T
+    if vary_q:
+        x0s = np.hstack([x0s, rng.uniform(q_min, q_max, (num_starts, 1))])
+
+    initargs = (fit_name, chimag, q, q_min, q_max, fit_kwargs)
+    with Pool(num_procs, initializer=_init_worker, \
+            initargs=initargs) as pool:
+        starts = pool.map(_run_start, [(x0, options) for x0 in x0s])
+
+    best = max(starts, key=lambda start: start['vfmag'])
+    result = dict(best)
+    result['starts'] = starts
+    result['num_fit_evals'] = sum(start['num_fit_evals'] for start in starts)
+    return result
+
+
+#############################    main    ##################################
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('--fit_name', type=str, default='NRSur7dq4Remnant',
+        help='surfinBH fit.')
+    parser.add_argument('--num_starts', type=int, default=16,
+        help='Number of optimizer starts.')
+    parser.add_argument('--chimag', type=float, default=1,
+        help='Spin magnitude of both black holes.')
+    parser.add_argument('--q', type=float, default=1,
+        help='Mass ratio, if not --vary_q.')
+    parser.add_argument('--vary_q', default=False, action='store_true',
+        help='Also optimize over the mass ratio, in [q_min, q_max].')
+    parser.add_argument('--q_min', type=float, default=1,
+        help='Smallest mass ratio, with --vary_q.')
+    parser.add_argument('--q_max', type=float, default=4,
+        help='Largest mass ratio, with --vary_q.')
+    parser.add_argument('--num_procs', type=int, default=None,
+        help='Number of worker processes. Default: number of cores.')
+    parser.add_argument('--seed', type=int, default=None,
+        help='Random seed for the starts.')
+
+    args = parser.parse_args()
+
+    result = search_max_kick(fit_name=args.fit_name, \
+        num_starts=args.num_starts, chimag=args.chimag, q=args.q, \
+        vary_q=args.vary_q, q_min=args.q_min, q_max=args.q_max, \
+        num_procs=args.num_procs, seed=args.seed)
+
+    print("Maximum kick found = %.5f c = %.1f km/s"%(result['vfmag'], \
+        result['vfmag']*scipy.constants.c/1e3))
+    print("For q=%.3f chiA=[%.3f, %.3f, %.3f] chiB=[%.3f, %.3f, %.3f]"%( \
+        result['q'], result['chiA'][0], result['chiA'][1], \
+        result['chiA'][2], result['chiB'][0], result['chiB'][1], \
+        result['chiB'][2]))
+    print("Best start: %d iterations, |vf| after every 10th: %s"%( \
+        len(result['history']), np.array2string(result['history'][::10], \
+        precision=5)))
+    print("Kicks of all starts: %s"%np.array2string(np.sort([start['vfmag'] \
+        for start in result['starts']])[::-1], precision=5))
+    print("Fit evaluations: %d"%result['num_fit_evals'])
@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+
+__doc__ = """model_server
+============
+
+Local server that keeps NRSur7dq2, surfinBH fits and gwsurrogate models
+loaded, and evaluates them for other processes on the same host, over a
+Unix socket.
+
+The models are loaded once, in the server process, which then forks the
+worker processes. The workers share the loaded models (copy-on-write), and
+each accepts connections on the same socket, so requests are evaluated
+concurrently by up to --num_workers processes.
+
+Each request is one connection. Messages are a small JSON header that
+describes the structure of the arguments or results, followed by the raw
+bytes of any numpy arrays in them.
+
+The client side is ModelClient, and get_model returns a drop-in stand-in
+for a loaded model, whose methods and attributes are evaluated by the
+server.
+
+Example usage:
+./model_server.py --nrsur7dq2 --surfinbh_fits surfinBH7dq2 NRSur7dq4Remnant
+    --gwsurrogate_models NRSur7dq4 --num_workers 8
+
+client = ModelClient()
+nr_sur = client.get_model('NRSur7dq2')    # instead of NRSurrogate7dq2()
+quat, orbphase, _, _ = nr_sur.get_dynamics(q, chiA, chiB, t_ref=-100)
+fit = client.get_model('surfinBH7dq2')    # instead of surfinBH.LoadFits
+mf, chif, vf, mf_err, chif_err, vf_err = fit.all(q, chiA, chiB)
+
+binaryBHexp uses the server if its MODEL_SERVER is set, through the
+environment variable BBH_MODEL_SERVER or the --model_server option.
+"""
+
+import numpy as np
+import os
+import json
+import socket
+import struct
+import tempfile
+import argparse
+import multiprocessing
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), \
+    'bbh_model_server_%d.sock'%os.getuid())
+
+
+#----------------------------------------------------------------------------
+def _to_wire(obj, buffers):
+    """ JSON serializable description of obj. The bytes of numpy arrays are
+    appended to buffers instead.
+    """
+    if isinstance(obj, np.ndarray):
+        if obj.dtype.hasobject:
+            raise Exception('Cannot send arrays of Python objects')
+        arr = np.ascontiguousarray(obj)
+        buffers.append(arr)
+        return {'__array__': arr.dtype.str, 'shape': list(arr.shape)}
+    if isinstance(obj, np.generic):
+        obj = obj.item()
+    if isinstance(obj, complex):
+        return {'__complex__': [obj.real, obj.imag]}
+    if isinstance(obj, tuple):
+        return {'__tuple__': [_to_wire(val, buffers) for val in obj]}
+    if isinstance(obj, list):
+        return [_to_wire(val, buffers) for val in obj]
+    if isinstance(obj, dict):
+        return {'__dict__': [[_to_wire(key, buffers), _to_wire(obj[key], \
+            buffers)] for key in obj]}
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    raise Exception('Cannot send objects of type %s'%type(obj).__name__)
+
+#----------------------------------------------------------------------------
+def _from_wire(obj, buffers):
+    """ Inverse of _to_wire. buffers is an iterator over the arrays.
+    """
+    if isinstance(obj, list):
+        return [_from_wire(val, buffers) for val in obj]
+    if isinstance(obj, dict):
+        if '__array__' in obj:
+            return next(buffers)
+        if '__complex__' in obj:
+            return complex(*obj['__complex__'])
+        if '__tuple__' in obj:
+            return tuple(_from_wire(val, buffers) for val in obj['__tuple__'])
+        if '__dict__' in obj:
+            return dict((_from_wire(key, buffers), _from_wire(val, buffers)) \
+                for key, val in obj['__dict__'])
+    return obj
+
+#----------------------------------------------------------------------------
+def _array_specs(obj, specs):
+    """ (dtype, shape) of the arrays in a wire description, in order.
+    """
+    if isinstance(obj, list):
+        for val in obj:
+            _array_specs(val, specs)
+    elif isinstance(obj, dict):
+        if '__array__' in obj:
+            specs.append((np.dtype(obj['__array__']), tuple(obj['shape'])))
+        for key in ['__tuple__', '__dict__']:
+            if key in obj:
+                _array_specs(obj[key], specs)
+    return specs
+
+#----------------------------------------------------------------------------
+def _recv_exactly(conn, num_bytes):
+    buf = bytearray(num_bytes)
+    view = memoryview(buf)
+    received = 0
+    while received < num_bytes:
+        num = conn.recv_into(view[received:])
+        if num == 0:
+            raise Exception('Connection closed')
+        received += num
+    return buf
+
+#----------------------------------------------------------------------------
+def send_message(conn, obj):
+    """ Sends obj: the length of the header, the JSON header, then the
+    bytes of each array.
+    """
+    buffers = []
+    header = json.dumps(_to_wire(obj, buffers)).encode('utf-8')
+    conn.sendall(struct.pack('!Q', len(header)) + header)
+    for arr in buffers:
+        if arr.nbytes > 0:
+            conn.sendall(memoryview(arr).cast('B'))
+
+#----------------------------------------------------------------------------
+def recv_message(conn):
+    """ Receives an object sent with send_message.
+    """
+    header_len, = struct.unpack('!Q', _recv_exactly(conn, 8))
+    header = json.loads(_recv_exactly(conn, header_len).decode('utf-8'))
+    arrays = []
+    for dtype, shape in _array_specs(header, []):
+        num_bytes = int(np.prod(shape))*dtype.itemsize
+        arrays.append(np.frombuffer(_recv_exactly(conn, num_bytes), \
+            dtype=dtype).reshape(shape))
+    return _from_wire(header, iter(arrays))
+
+#----------------------------------------------------------------------------
+def load_models(nrsur7dq2=False, surfinbh_fits=(), gwsurrogate_models=()):
+    """ Loads the models, and returns them in a dict keyed by name:
+    'NRSur7dq2', the surfinBH fit names and the gwsurrogate model names.
+    """
+    models = {}
+    if nrsur7dq2:
+        import NRSur7dq2
+        models['NRSur7dq2'] = NRSur7dq2.NRSurrogate7dq2()
+    if len(surfinbh_fits) > 0:
+        import surfinBH
+        for fit_name in surfinbh_fits:
+            models[fit_name] = surfinBH.LoadFits(fit_name)
+    if len(gwsurrogate_models) > 0:
+        import gwsurrogate
+        for model in gwsurrogate_models:
+            models[model] = gwsurrogate.LoadSurrogate(model)
+    return models
+
+#----------------------------------------------------------------------------
+def handle_request(models, request):
+    """ Evaluates a request: models[model].method(*args, **kwargs). The
+    method '__getattr__' returns the attribute args[0], or marks it as
+    callable, and 'list_models' returns the model names.
+    """
+    method = request['method']
+    if method == 'list_models':
+        return sorted(models.keys())
+
+    model = request['model']
+    if model not in models:
+        raise Exception('Model %s is not loaded by the server'%model)
+    if method == '__getattr__':
+        name = request['args'][0]
+        if name.startswith('_'):
+            raise Exception('Private attribute %s'%name)
+        value = getattr(models[model], name)
+        if callable(value):
+            return {'__callable__': True}
+        return value
+    if method != '__call__' and method.startswith('_'):
+        raise Exception('Private method %s'%method)
+    return getattr(models[model], method)(*request['args'], \
+        **request['kwargs'])
+
+#----------------------------------------------------------------------------
+def _serve_forever(sock, models):
+    """ Worker loop, one request per connection.
+    """
+    while True:
+        conn, _ = sock.accept()
+        with conn:
+            try:
+                request = recv_message(conn)
+            except Exception:
+                continue
+            try:
+                response = {'result': handle_request(models, request)}
+            except Exception as e:
+                response = {'error': '%s: %s'%(type(e).__name__, e)}
+            try:
+                send_message(conn, response)
+            except Exception as e:
+                # The result could not be sent, for eg. an unsupported
+                # type, or the client went away
+                try:
+                    send_message(conn, {'error': '%s: %s'%( \
+                        type(e).__name__, e)})
+                except Exception:
+                    pass
+
+#----------------------------------------------------------------------------
+def run_server(models, socket_path=DEFAULT_SOCKET, num_workers=None):
+    """ Serves the models on the Unix socket socket_path, with num_workers
+    forked worker processes (default: number of cores), until interrupted.
+    """
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(socket_path)
+    # Only this user can connect
+    os.chmod(socket_path, 0o600)
+    sock.listen(128)
+
+    ctx = multiprocessing.get_context('fork')
+    workers = [ctx.Process(target=_serve_forever, args=(sock, models), \
+        daemon=True) for idx in range(num_workers)]
+    for worker in workers:
+        worker.start()
+    print('Serving %s on %s with %d workers'%(', '.join(sorted( \
+        models.keys())), socket_path, num_workers))
+
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            worker.terminate()
+        sock.close()
+        os.unlink(socket_path)
+
+#----------------------------------------------------------------------------
+class ModelClient(object):
+    """ Client of a model server.
+
+    Usage:
+    client = ModelClient()
+    print(client.list_models())
+    nr_sur = client.get_model('NRSur7dq2')
+    """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET):
+        self.socket_path = socket_path
+
+    def request(self, model, method, *args, **kwargs):
+        """ Evaluates model.method(*args, **kwargs) on the server.
+        """
+        request = {'model': model, 'method': method, 'args': list(args), \
+            'kwargs': kwargs}
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.connect(self.socket_path)
+            send_message(conn, request)
+            response = recv_message(conn)
+        if 'error' in response:
+            raise Exception('Model server: %s'%response['error'])
+        return response['result']
+
+    def list_models(self):
+        return self.request(None, 'list_models')
+
+    def get_model(self, model):
+        return RemoteModel(self, model)
+
+#----------------------------------------------------------------------------
+class RemoteModel(object):
+    """ Stand-in for a model loaded by the server. Calling it, its methods
+    and its attributes are evaluated by the server. Attributes are fetched
+    once and then kept.
+    """
+
+    def __init__(self, client, model):
+        self._client = client
+        self._model = model
+        self._attrs = {}
+
+    def __call__(self, *args, **kwargs):
+        return self._client.request(self._model, '__call__', *args, **kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name not in self._attrs:
+            value = self._client.request(self._model, '__getattr__', name)
+            if isinstance(value, dict) and value.get('__callable__'):
+                def method(*args, **kwargs):
+                    return self._client.request(self._model, name, *args, \
+                        **kwargs)
+                value = method
+            self._attrs[name] = value
+        return self._attrs[name]
+
+
+#############################    main    ##################################
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('--socket_path', type=str, default=DEFAULT_SOCKET,
+        help='Unix socket to serve on.')
+    parser.add_argument('--num_workers', type=int, default=None,
+        help='Number of worker processes. Default: number of cores.')
+    parser.add_argument('--nrsur7dq2', default=False, action='store_true',
+        help='Load NRSur7dq2.')
+    parser.add_argument('--surfinbh_fits', type=str, nargs='*', default=[],
+        help='surfinBH fits to load.')
+    parser.add_argument('--gwsurrogate_models', type=str, nargs='*',
+        default=[], help='gwsurrogate models to load.')
+
+    args = parser.parse_args()
+
+    models = load_models(nrsur7dq2=args.nrsur7dq2, \
+        surfinbh_fits=args.surfinbh_fits, \
+        gwsurrogate_models=args.gwsurrogate_models)
+    if len(models) == 0:
+        raise Exception('No models to serve')
+    run_server(models, socket_path=args.socket_path, \
+        num_workers=args.num_workers)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+__doc__ = """remnant_population
+==================
+
+Remnant mass, spin and kick distributions of populations of binaries, as in
+the exercises of surfinBH.ipynb, but for millions of binaries.
+
+The binaries are drawn in one vectorized step: uniform mass ratios and spin
+magnitudes, and isotropic spin directions. The remnant properties and their
+error estimates are then evaluated with a single fit.all call per binary,
+instead of separate fit.mf, fit.chif and fit.vf calls, over a process pool
+in which each worker loads the fit once. The results are streamed chunk by
+chunk into a columnar HDF5 file, one dataset per quantity.
+
+Usage:
+simulate_population('population.h5', 1000000, num_procs=8)
+pop = load_population('population.h5')
+P.hist(np.linalg.norm(pop['chif'], axis=1), bins=50)
+
+Example usage:
+./remnant_population.py --num_binaries 1000000 --num_procs 8
+    --out_file population.h5
+"""
+
+import numpy as np
+import argparse
+import h5py
+from multiprocessing import Pool
+
+import surfinBH
+
+# Columns of the population file. The binary parameters are written first,
+# the remnant properties as the fits are evaluated.
+INPUT_COLUMNS = ['q', 'chiA', 'chiB']
+OUTPUT_COLUMNS = ['mf', 'chif', 'vf', 'mf_err', 'chif_err', 'vf_err']
+
+
+#----------------------------------------------------------------------------
+def isotropic_unit_vectors(num, rng=np.random):
+    """ num unit vectors with isotropic directions, as a (num x 3) array.
+    """
+    theta = np.arccos(rng.uniform(-1, 1, num))
+    phi = rng.uniform(0, 2*np.pi, num)
+    return np.array([np.sin(theta)*np.cos(phi), np.sin(theta)*np.sin(phi), \
+        np.cos(theta)]).T
+
+#----------------------------------------------------------------------------
+def draw_binaries(num, q_min=1, q_max=4, chi_min=0, chi_max=1, seed=None):
+    """ Draws num binaries with mass ratios uniform in [q_min, q_max], spin
+    magnitudes uniform in [chi_min, chi_max], and isotropic spin
+    directions. Use q_min = q_max or chi_min = chi_max to fix them.
+
+    Returns q (num,), chiA (num x 3), chiB (num x 3).
+    """
+    rng = np.random.RandomState(seed)
+    q = rng.uniform(q_min, q_max, num)
+    chiA = rng.uniform(chi_min, chi_max, num)[:, None] \
+        *isotropic_unit_vectors(num, rng)
+    chiB = rng.uniform(chi_min, chi_max, num)[:, None] \
+        *isotropic_unit_vectors(num, rng)
+    return q, chiA, chiB
+
+#----------------------------------------------------------------------------
+# The fit of each worker, loaded once by _init_worker.
+_worker_fit = {}
+
+def _init_worker(fit_name):
+    _worker_fit['fit'] = surfinBH.LoadFits(fit_name)
+
+#----------------------------------------------------------------------------
+def _eval_chunk(args):
+    """ Evaluates fit.all for a chunk of binaries. Returns the columns of
+    OUTPUT_COLUMNS.
+    """
+    q, chiA, chiB, fit_kwargs = args
+    fit = _worker_fit['fit']
+
+    num = len(q)
+    mf = np.empty(num)
+    mf_err = np.empty(num)
+    chif = np.empty((num, 3))
+    chif_err = np.empty((num, 3))
+    vf = np.empty((num, 3))
+    vf_err = np.empty((num, 3))
+    for idx in range(num):
+        mf[idx], chif[idx], vf[idx], mf_err[idx], chif_err[idx], \
+            vf_err[idx] = fit.all(q[idx], chiA[idx], chiB[idx], **fit_kwargs)
+    return mf, chif, vf, mf_err, chif_err, vf_err
+
+#----------------------------------------------------------------------------
+def evaluate_remnants(q, chiA, chiB, fit_name='NRSur7dq4Remnant', \
+        num_procs=None, chunk_size=1000, **fit_kwargs):
+    """ Evaluates the remnant properties of the binaries q, chiA, chiB, in
+    chunks of chunk_size binaries over num_procs processes.
+
+    fit_kwargs: passed on to fit.all, for eg. omega0.
+
+    Yields (start, columns) for each chunk, in order, where columns is a
+    dict of the OUTPUT_COLUMNS of binaries start to start + chunk_size.
+    """
+    tasks = [(q[start:start+chunk_size], chiA[start:start+chunk_size], \
+        chiB[start:start+chunk_size], fit_kwargs) \
+        for start in range(0, len(q), chunk_size)]
+    with Pool(num_procs, initializer=_init_worker, \
+            initargs=(fit_name,)) as pool:
+        for idx, result in enumerate(pool.imap(_eval_chunk, tasks)):
+            yield idx*chunk_size, dict(zip(OUTPUT_COLUMNS, result))
+
+#----------------------------------------------------------------------------
+def simulate_population(filename, num, fit_name='NRSur7dq4Remnant', \
+        num_procs=None, chunk_size=1000, seed=None, verbose=False, \
+        fit_kwargs=None, **draw_kwargs):
+    """ Draws num binaries with draw_binaries(**draw_kwargs), evaluates
+    their remnants with evaluate_remnants, and writes everything to the
+    HDF5 file filename, as it comes in.
+
+    Each column of INPUT_COLUMNS and OUTPUT_COLUMNS is a dataset with num
+    rows. The attribute 'num_done' is the number of binaries whose remnants
+    have been written, so a partially written file can still be used.
+
+    fit_kwargs: dict passed on to fit.all, for eg. {'omega0': 7e-3}.
+    """
+    if fit_kwargs is None:
+        fit_kwargs = {}
+    q, chiA, chiB = draw_binaries(num, seed=seed, **draw_kwargs)
+
+    with h5py.File(filename, 'w') as f:
+        f.attrs['fit_name'] = fit_name
+        f.attrs['num_done'] = 0
+        for key in draw_kwargs.keys():
+            f.attrs[key] = draw_kwargs[key]
+        f.create_dataset('q', data=q)
+        f.create_dataset('chiA', data=chiA)
+        f.create_dataset('chiB', data=chiB)
+        for name in OUTPUT_COLUMNS:
+            shape = (num,) if name in ['mf', 'mf_err'] else (num, 3)
+            f.create_dataset(name, shape=shape, dtype=float)
+
+        for start, columns in evaluate_remnants(q, chiA, chiB, \
+                fit_name=fit_name, num_procs=num_procs, \
+                chunk_size=chunk_size, **fit_kwargs):
+            end = start + len(columns['mf'])
+            for name in OUTPUT_COLUMNS:
+                f[name][start:end] = columns[name]
+            f.attrs['num_done'] = end
+            f.flush()
+            if verbose:
+                print('%d/%d binaries done'%(end, num))
+
+#----------------------------------------------------------------------------
+def load_population(filename, columns=None):
+    """ Reads the columns (default: all) of the binaries whose remnants have
+    been written, from a file written by simulate_population. Returns a
+    dict of arrays.
+    """
+    if columns is None:
+        columns = INPUT_COLUMNS + OUTPUT_COLUMNS
+    with h5py.File(filename, 'r') as f:
+        num_done = f.attrs['num_done']
+        return dict((name, f[name][:num_done]) for name in columns)
+
+
+#############################    main    ##################################
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('--num_binaries', type=int, default=100000,
+        help='Number of binaries.')
+    parser.add_argument('--out_file', type=str, required=True,
+        help='HDF5 file to write the population to.')
+    parser.add_argument('--fit_name', type=str, default='NRSur7dq4Remnant',
+        help='surfinBH fit.')
+    parser.add_argument('--q_min', type=float, default=1,
+        help='Smallest mass ratio.')
+    parser.add_argument('--q_max', type=float, default=4,
+        help='Largest mass ratio.')
+    parser.add_argument('--chi_min', type=float, default=0,
+        help='Smallest spin magnitude.')
+    parser.add_argument('--chi_max', type=float, default=1,
+        help='Largest spin magnitude.')
+    parser.add_argument('--num_procs', type=int, default=None,
+        help='Number of worker processes. Default: number of cores.')
+    parser.add_argument('--chunk_size', type=int, default=1000,
+        help='Number of binaries per task.')
+    parser.add_argument('--seed', type=int, default=None,
+        help='Random seed.')
+
+    args = parser.parse_args()
+
+    simulate_population(args.out_file, args.num_binaries, \
+        fit_name=args.fit_name, num_procs=args.num_procs, \
+        chunk_size=args.chunk_size, seed=args.seed, verbose=True, \
+        q_min=args.q_min, q_max=args.q_max, chi_min=args.chi_min, \
+        chi_max=args.chi_max)
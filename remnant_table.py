@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+
+__doc__ = """remnant_table
+=============
+
+Precomputed lookup table of the remnant mass, spin and kick of a surfinBH
+fit, for interactive use and parameter sweeps, where evaluating the fit
+itself is the bottleneck.
+
+The fit is evaluated once, over a process pool, on a regular grid in the
+mass ratio and the spin magnitudes and polar and azimuthal angles of both
+black holes, in the same frame the fit uses. The table is saved in an HDF5
+file, and memory-mapped when loaded, so that loading is instant and only
+the parts of the table that are looked up are read from disk. Lookups are
+multilinear interpolations on the grid, vectorized over binaries. A single
+lookup takes of order 100-200 microseconds, mostly fixed numpy overhead;
+vectorized over many binaries, it takes about 30 microseconds per binary.
+Both are much faster than evaluating the fit.
+
+Error bound: after building, the table is compared with the fit at random
+binaries inside its domain. The largest differences in mf, |chif| and |vf|
+components are saved with the table (attributes mf_table_err,
+chif_table_err, vf_table_err), and RemnantTable.all adds them to the error
+estimates of the fit, so its errors bound the difference to the fit at
+all the validation binaries. The bound is empirical, and shrinks with the
+grid resolution.
+
+RemnantTable.all falls back to the fit itself for binaries outside the
+domain of the table, for a different omega0 than the table was built for,
+for any other keyword arguments of fit.all, or if precise=True.
+
+Usage:
+build_table('remnant_table.h5', num_procs=8)
+table = RemnantTable('remnant_table.h5')
+mf, chif, vf, mf_err, chif_err, vf_err = table.all(q, chiA, chiB)
+
+binaryBHexp uses the table instead of surfinBH7dq2 if its REMNANT_TABLE is
+set, through the environment variable BBH_REMNANT_TABLE or the
+--remnant_table option.
+
+Example usage:
+./remnant_table.py --out_file remnant_table.h5 --num_procs 8
+"""
+
+import numpy as np
+import argparse
+import h5py
+
+import surfinBH
+
+import remnant_population
+
+# Columns of the table, in the order of the outputs of fit.all
+COLUMNS = [('mf', 1), ('chif', 3), ('vf', 3), ('mf_err', 1), \
+    ('chif_err', 3), ('vf_err', 3)]
+NUM_COLUMNS = sum(size for name, size in COLUMNS)
+
+# Dimensions of the grid
+GRID_AXES = ['q', 'chiAmag', 'chiAth', 'chiAph', 'chiBmag', 'chiBth', \
+    'chiBph']
+
+
+#----------------------------------------------------------------------------
+def spin_to_angles(chi):
+    """ Magnitudes, polar and azimuthal angles (in [0, 2 pi)) of spins,
+    given as an (num x 3) array.
+    """
+    chi = np.atleast_2d(chi)
+    chimag = np.linalg.norm(chi, axis=1)
+    cos_th = chi[:,2]/np.where(chimag > 0, chimag, 1)
+    theta = np.arccos(np.clip(cos_th, -1, 1))
+    phi = np.arctan2(chi[:,1], chi[:,0]) % (2*np.pi)
+    return chimag, theta, phi
+
+#----------------------------------------------------------------------------
+def angles_to_spin(chimag, theta, phi):
+    """ Inverse of spin_to_angles.
+    """
+    return np.array([chimag*np.sin(theta)*np.cos(phi), \
+        chimag*np.sin(theta)*np.sin(phi), chimag*np.cos(theta)]).T
+
+#----------------------------------------------------------------------------
+def get_grid_axes(q_min, q_max, chi_max, num_q, num_chi, num_theta, num_phi):
+    """ Grid points along each of GRID_AXES. The azimuthal angles are
+    periodic, so 2 pi is left out. Every axis needs at least 2 points, for
+    the grid spacing used in the interpolation.
+    """
+    for name, num in [('num_q', num_q), ('num_chi', num_chi), \
+            ('num_theta', num_theta), ('num_phi', num_phi)]:
+        if num < 2:
+            raise Exception('%s must be at least 2, got %s'%(name, num))
+    q = np.linspace(q_min, q_max, num_q)
+    chimag = np.linspace(0, chi_max, num_chi)
+    theta = np.linspace(0, np.pi, num_theta)
+    phi = np.linspace(0, 2*np.pi, num_phi, endpoint=False)
+    return [q, chimag, theta, phi, chimag, theta, phi]
+
+#----------------------------------------------------------------------------
+def _split_columns(values):
+    """ fit.all outputs from the (num x NUM_COLUMNS) values.
+    """
+    outputs = []
+    start = 0
+    for name, size in COLUMNS:
+        if size == 1:
+            outputs.append(values[:,start])
+        else:
+            outputs.append(values[:,start:start+size])
+        start += size
+    return outputs
+
+#----------------------------------------------------------------------------
+class RemnantTable(object):
+    """ Memory-mapped remnant lookup table written by build_table, with the
+    interface of fit.all. See the module documentation.
+    """
+
+    def __init__(self, filename, fit=None):
+        """ fit: the surfinBH fit to fall back to. If None, it is loaded with
+        surfinBH.LoadFits the first time it is needed.
+        """
+        with h5py.File(filename, 'r') as f:
+            dset = f['values']
+            offset = dset.id.get_offset()
+            if offset is None:
+                raise Exception('The values of %s are not stored ' \
+                    'contiguously, and cannot be memory-mapped'%filename)
+            shape = dset.shape
+            dtype = dset.dtype
+            self.attrs = dict(f.attrs)
+
+        self.values = np.memmap(filename, dtype=dtype, mode='r', \
+            offset=offset, shape=shape)
+        self.flat_values = self.values.reshape(-1, NUM_COLUMNS)
+        self.grid_shape = np.array(shape[:-1])
+        self.fit_name = self.attrs['fit_name']
+        self.omega0 = self.attrs.get('omega0', None)
+        self.q_min = self.attrs['q_min']
+        self.q_max = self.attrs['q_max']
+        self.chi_max = self.attrs['chi_max']
+        self.axes = get_grid_axes(self.q_min, self.q_max, self.chi_max, \
+            *shape[:4])
+
+        # Grid layout, for lookup
+        self._grid_start = np.array([axis[0] for axis in self.axes])
+        self._grid_step = np.array([axis[1] - axis[0] for axis in self.axes])
+        self._periodic = np.array([name.endswith('ph') for name in GRID_AXES])
+        self._corners = (np.arange(2**len(GRID_AXES))[:, None] \
+            >> np.arange(len(GRID_AXES))) & 1
+        self._strides = np.cumprod(np.append(self.grid_shape[1:], \
+            1)[::-1])[::-1]
+
+        # Errors added to those of the fit, see the module documentation
+        self.mf_table_err = self.attrs.get('mf_table_err', 0)
+        self.chif_table_err = self.attrs.get('chif_table_err', 0)
+        self.vf_table_err = self.attrs.get('vf_table_err', 0)
+
+        self._fit = fit
+
+    @property
+    def fit(self):
+        if self._fit is None:
+            self._fit = surfinBH.LoadFits(self.fit_name)
+        return self._fit
+
+    def in_domain(self, q, chiA, chiB):
+        """ Whether each binary is inside the domain of the table.
+        """
+        q = np.atleast_1d(q)
+        chiAmag = np.linalg.norm(np.atleast_2d(chiA), axis=1)
+        chiBmag = np.linalg.norm(np.atleast_2d(chiB), axis=1)
+        return (q >= self.q_min) & (q <= self.q_max) \
+            & (chiAmag <= self.chi_max) & (chiBmag <= self.chi_max)
+
+    def lookup(self, q, chiA, chiB, chunk_size=4096):
+        """ Multilinear interpolation of the table, for num binaries given as
+        arrays q (num,), chiA and chiB (num x 3), all inside the domain.
+        Returns the (num x NUM_COLUMNS) values, without the table errors.
+        The binaries are interpolated chunk_size at a time.
+        """
+        q = np.atleast_1d(q)
+        chiA = np.atleast_2d(chiA)
+        chiB = np.atleast_2d(chiB)
+        if len(q) > chunk_size:
+            return np.concatenate([self.lookup(q[start:start+chunk_size], \
+                chiA[start:start+chunk_size], chiB[start:start+chunk_size]) \
+                for start in range(0, len(q), chunk_size)])
+
+        params = np.column_stack((q,) + spin_to_angles(chiA) \
+            + spin_to_angles(chiB))
+
+        # Lower grid index and weight of the upper grid point, along each
+        # axis
+        pos = (params - self._grid_start)/self._grid_step
+        lower = np.floor(pos).astype(int)
+        lower = np.where(self._periodic, lower, np.clip(lower, 0, \
+            self.grid_shape - 2))
+        weights = pos - lower
+
+        # The 2^7 corners of the grid cell. The azimuthal angles wrap around.
+        idx = (lower[:, None, :] + self._corners) % self.grid_shape
+        corner_weights = np.prod(np.where(self._corners, weights[:, None, :], \
+            1 - weights[:, None, :]), axis=2)
+        return np.einsum('nc,nck->nk', corner_weights, \
+            self.flat_values[np.dot(idx, self._strides)])
+
+    def all(self, q, chiA, chiB, omega0=None, precise=False, **kwargs):
+        """ Same outputs as fit.all, from the table if possible, else from
+        the fit. The errors from the table include the table errors.
+        """
+        if precise or len(kwargs) > 0 or omega0 != self.omega0 \
+                or not self.in_domain(q, chiA, chiB)[0]:
+            return self.fit.all(q, chiA, chiB, omega0=omega0, **kwargs)
+
+        mf, chif, vf, mf_err, chif_err, vf_err = _split_columns( \
+            self.lookup(q, chiA, chiB))
+        return mf[0], chif[0], vf[0], mf_err[0] + self.mf_table_err, \
+            chif_err[0] + self.chif_table_err, vf_err[0] + self.vf_table_err
+
+#----------------------------------------------------------------------------
+def _evaluate_fit(q, chiA, chiB, fit_name, num_procs, chunk_size, fit_kwargs):
+    """ (num x NUM_COLUMNS) outputs of fit.all, with
+    remnant_population.evaluate_remnants.
+    """
+    values = np.empty((len(q), NUM_COLUMNS))
+    for start, columns in remnant_population.evaluate_remnants(q, chiA, \
+            chiB, fit_name=fit_name, num_procs=num_procs, \
+            chunk_size=chunk_size, **fit_kwargs):
+        end = start + len(columns['mf'])
+        values[start:end] = np.column_stack([columns[name] for name, size \
+            in COLUMNS])
+    return values
+
+#----------------------------------------------------------------------------
+def validate_table(table, num, num_procs=None, chunk_size=1000, seed=None):
+    """ Largest differences between the table and its fit, at num random
+    binaries inside its domain: of mf, and of the components of chif and
+    vf.
+    """
+    q, chiA, chiB = remnant_population.draw_binaries(num, q_min=table.q_min, \
+        q_max=table.q_max, chi_min=0, chi_max=table.chi_max, seed=seed)
+    fit_kwargs = {} if table.omega0 is None else {'omega0': table.omega0}
+    exact = _split_columns(_evaluate_fit(q, chiA, chiB, table.fit_name, \
+        num_procs, chunk_size, fit_kwargs))
+    approx = _split_columns(table.lookup(q, chiA, chiB))
+    return [np.max(np.abs(exact[idx] - approx[idx])) for idx in range(3)]
+
+#----------------------------------------------------------------------------
+def build_table(filename, fit_name='surfinBH7dq2', q_min=1, q_max=2, \
+        chi_max=0.8, num_q=5, num_chi=4, num_theta=7, num_phi=8, \
+        omega0=None, num_validation=1000, num_procs=None, chunk_size=1000, \
+        seed=None, verbose=False):
+    """ Evaluates the fit on the grid and writes the table to the HDF5 file
+    filename, then validates it at num_validation random binaries and saves
+    the table errors. Returns the RemnantTable.
+
+    The grid has num_q mass ratios in [q_min, q_max], num_chi spin
+    magnitudes in [0, chi_max], num_theta polar angles in [0, pi] and
+    num_phi azimuthal angles in [0, 2 pi), for each black hole. Each of
+    these must be at least 2. The default domain is that of surfinBH7dq2.
+
+    omega0: passed on to fit.all. The table is only used for this omega0.
+    """
+    axes = get_grid_axes(q_min, q_max, chi_max, num_q, num_chi, num_theta, \
+        num_phi)
+    grid_shape = tuple(len(axis) for axis in axes)
+    params = [val.flatten() for val in np.meshgrid(*axes, indexing='ij')]
+    q = params[0]
+    chiA = angles_to_spin(*params[1:4])
+    chiB = angles_to_spin(*params[4:7])
+    if verbose:
+        print('Evaluating %s at %d grid points'%(fit_name, len(q)))
+
+    fit_kwargs = {} if omega0 is None else {'omega0': omega0}
+    values = _evaluate_fit(q, chiA, chiB, fit_name, num_procs, chunk_size, \
+        fit_kwargs)
+
+    with h5py.File(filename, 'w') as f:
+        f.attrs['fit_name'] = fit_name
+        if omega0 is not None:
+            f.attrs['omega0'] = omega0
+        f.attrs['q_min'] = q_min
+        f.attrs['q_max'] = q_max
+        f.attrs['chi_max'] = chi_max
+        # Contiguous, uncompressed, so that it can be memory-mapped
+        f.create_dataset('values', data=values.reshape(grid_shape \
+            + (NUM_COLUMNS,)))
+
+    if num_validation > 0:
+        table = RemnantTable(filename)
+        errors = validate_table(table, num_validation, num_procs=num_procs, \
+            chunk_size=chunk_size, seed=seed)
+        with h5py.File(filename, 'a') as f:
+            f.attrs['num_validation'] = num_validation
+            for name, err in zip(['mf', 'chif', 'vf'], errors):
+                f.attrs['%s_table_err'%name] = err
+        if verbose:
+            print('Table errors: mf %.2e, chif %.2e, vf %.2e'%tuple(errors))
+
+    return RemnantTable(filename)
+
+
+#############################    main    ##################################
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('--out_file', type=str, required=True,
+        help='HDF5 file to write the table to.')
+    parser.add_argument('--fit_name', type=str, default='surfinBH7dq2',
+        help='surfinBH fit.')
+    parser.add_argument('--q_min', type=float, default=1,
+        help='Smallest mass ratio.')
+    parser.add_argument('--q_max', type=float, default=2,
+        help='Largest mass ratio.')
+    parser.add_argument('--chi_max', type=float, default=0.8,
+        help='Largest spin magnitude.')
+    parser.add_argument('--num_q', type=int, default=5,
+        help='Number of mass ratios in the grid.')
+    parser.add_argument('--num_chi', type=int, default=4,
+        help='Number of spin magnitudes in the grid.')
+    parser.add_argument('--num_theta', type=int, default=7,
+        help='Number of spin polar angles in the grid.')
+    parser.add_argument('--num_phi', type=int, default=8,
+        help='Number of spin azimuthal angles in the grid.')
+    parser.add_argument('--omega0', type=float, default=None,
+        help='Reference orbital frequency passed on to the fit.')
+    parser.add_argument('--num_validation', type=int, default=1000,
+        help='Number of random binaries to estimate the table errors with.')
+    parser.add_argument('--num_procs', type=int, default=None,
+        help='Number of worker processes. Default: number of cores.')
+    parser.add_argument('--seed', type=int, default=None,
+        help='Random seed for the validation binaries.')
+
+    args = parser.parse_args()
+
+    build_table(args.out_file, fit_name=args.fit_name, q_min=args.q_min, \
+        q_max=args.q_max, chi_max=args.chi_max, num_q=args.num_q, \
+        num_chi=args.num_chi, num_theta=args.num_theta, \
+        num_phi=args.num_phi, omega0=args.omega0, \
+        num_validation=args.num_validation, num_procs=args.num_procs, \
+        seed=args.seed, verbose=True)
@@ -0,0 +1,597 @@
+__doc__ = """surrogate_1d
+============
+
+Building blocks for the 1D EOBNRv2 surrogate of ICERM-build-1d-model.ipynb,
+written to scale to large training sets.
+
+The training data can be a list of complex waveforms, or an
+eob_training.TrainingSet.
+
+A built surrogate can be saved with save_surrogate, and loaded without
+this module's dependencies using surrogate_1d_loader.load_surrogate.
+"""
+
+import numpy as np
+import time
+from scipy.linalg import solve_triangular
+from scipy.interpolate import splrep
+import h5py
+import json
+import datetime
+
+from surrogate_1d_loader import Surrogate1D, AmpPhaseSurrogate1D, \
+    MultiModeSurrogate1D, get_mode_name, cubic_interp, USERBLOCK_SIZE, \
+    FORMAT_NAME, FORMAT_VERSION
+
+
+#----------------------------------------------------------------------------
+def get_peaks(training_data):
+    """ Index of the peak of |h| for each waveform in the training set.
+    """
+    if isinstance(training_data, np.ndarray) and training_data.ndim == 2:
+        # Columns are the waveforms
+        return np.argmax(np.abs(training_data), axis=0)
+    return np.array([np.argmax(np.abs(h)) for h in training_data], \
+        dtype=np.int64)
+
+#----------------------------------------------------------------------------
+def align_and_pad(training_data, dt, out_file=None, dtype=complex, \
+        peak_idx=None, verbose=False):
+    """ Peak aligns the waveforms and pads them with zeros to a common
+    length, in a single pass. Does the same as common_time_grid followed by
+    align_peaks in the notebook: the waveform with the earliest peak is
+    the reference one, and the common length is that of the longest
+    waveform.
+
+    Each waveform is written straight into one preallocated Fortran ordered
+    (times x samples) matrix, so the peak memory is about one copy of the
+    training data.
+
+    training_data: list of complex waveforms, or eob_training.TrainingSet.
+    dt: time step of the waveforms.
+    out_file: If given, the matrix is memory-mapped to a .npy file at this
+        path instead of being held in memory.
+    dtype: dtype of the matrix. np.complex64 halves its memory, and the
+        basis built from it is then also single precision.
+    peak_idx: indices to align the waveforms by. Default: their peaks. For
+        the modes of a waveform, the peaks of the (2,2) mode, so that all
+        modes are shifted together.
+
+    Returns times, training_data_aligned, peak_idx, where peak_idx are the
+    peak indices of the waveforms before alignment.
+    """
+    if peak_idx is None:
+        peak_idx = get_peaks(training_data)
+    peak_idx = np.asarray(peak_idx)
+    lengths = np.array([len(h) for h in training_data])
+
+    shift = peak_idx - np.min(peak_idx)
+    n_times = np.max(lengths)
+    shape = (int(n_times), len(lengths))
+
+    if out_file is None:
+        training_data_aligned = np.zeros(shape, dtype=dtype, order='F')
+    else:
+        # A new .npy file is zero filled
+        training_data_aligned = np.lib.format.open_memmap(out_file, \
+            mode='w+', dtype=dtype, shape=shape, fortran_order=True)
+
+    for idx, h in enumerate(training_data):
+        h_aligned = h[shift[idx]:]
+        training_data_aligned[:len(h_aligned), idx] = h_aligned
+        if verbose:
+            print("Waveform %i with offset value of %i"%(idx, shift[idx]))
+
+    if out_file is not None:
+        training_data_aligned.flush()
+
+    times = np.arange(n_times)*dt
+    return times, training_data_aligned, peak_idx
+
+#----------------------------------------------------------------------------
+def relative_max_error(h, h_sur):
+    """ max|h - h_sur| / max|h|, along the last axis.
+    """
+    return np.max(np.abs(h - h_sur), axis=-1)/np.max(np.abs(h), axis=-1)
+
+#----------------------------------------------------------------------------
+def align_to_grid(h, peak_idx, num_times):
+    """ Shifts h such that its peak is at peak_idx, the peak index of the
+    aligned training data, and pads or truncates it to num_times samples.
+    """
+    shift = np.argmax(np.abs(h)) - peak_idx
+    h_aligned = np.zeros(num_times, dtype=complex)
+    if shift >= 0:
+        h = h[shift:shift+num_times]
+        h_aligned[:len(h)] = h
+    else:
+        h = h[:num_times+shift]
+        h_aligned[-shift:-shift+len(h)] = h
+    return h_aligned
+
+#----------------------------------------------------------------------------
+def get_basis_size(s, tol, max_size=None):
+    """ Number of singular values s[i] > tol*s[0], at most max_size.
+    """
+    size = int(np.sum(s > tol*s[0]))
+    if max_size is not None:
+        size = min(size, max_size)
+    return max(size, 1)
+
+#----------------------------------------------------------------------------
+def iter_column_chunks(A, chunk_size):
+    """ Yields blocks of chunk_size columns of A. For a memory-mapped A, only
+    one block is read into memory at a time.
+    """
+    for start in range(0, A.shape[1], chunk_size):
+        yield np.asarray(A[:, start:start+chunk_size])
+
+#----------------------------------------------------------------------------
+def _dot_by_column_chunks(A, X, chunk_size):
+    """ A.X, reading chunk_size columns of A at a time.
+    """
+    AX = np.zeros((A.shape[0], X.shape[1]), dtype=np.result_type(A, X))
+    for start, A_chunk in zip(range(0, A.shape[1], chunk_size), \
+            iter_column_chunks(A, chunk_size)):
+        AX += np.dot(A_chunk, X[start:start+chunk_size])
+    return AX
+
+#----------------------------------------------------------------------------
+def _hdot_by_column_chunks(Q, A, chunk_size):
+    """ Q^H.A, reading chunk_size columns of A at a time.
+    """
+    QhA = np.empty((Q.shape[1], A.shape[1]), dtype=np.result_type(Q, A))
+    Qh = Q.conjugate().transpose()
+    for start, A_chunk in zip(range(0, A.shape[1], chunk_size), \
+            iter_column_chunks(A, chunk_size)):
+        QhA[:, start:start+chunk_size] = np.dot(Qh, A_chunk)
+    return QhA
+
+#----------------------------------------------------------------------------
+def randomized_svd(A, rank, n_oversamples=10, n_power_iter=2, \
+        chunk_size=500, seed=None):
+    """ Randomized SVD of A (Halko, Martinsson & Tropp,
+    https://arxiv.org/abs/0909.4061). Only the leading rank left singular
+    vectors and singular values are returned.
+
+    A is only accessed through products with blocks of chunk_size columns,
+    so it can be a memory-mapped array larger than the available memory.
+    Each power iteration costs two passes over A and improves the accuracy
+    when the singular values decay slowly.
+    """
+    rng = np.random.RandomState(seed)
+    num_cols = A.shape[1]
+    k = min(rank + n_oversamples, num_cols)
+
+    Omega = rng.standard_normal((num_cols, k))
+    if np.iscomplexobj(A):
+        Omega = Omega + 1j*rng.standard_normal((num_cols, k))
+
+    Q, _ = np.linalg.qr(_dot_by_column_chunks(A, Omega, chunk_size))
+    for i in range(n_power_iter):
+        Z, _ = np.linalg.qr(_hdot_by_column_chunks(Q, A, chunk_size)\
+            .conjugate().transpose())
+        Q, _ = np.linalg.qr(_dot_by_column_chunks(A, Z, chunk_size))
+
+    u_small, s, _ = np.linalg.svd(_hdot_by_column_chunks(Q, A, chunk_size), \
+        full_matrices=False)
+    u = np.dot(Q, u_small)
+    return u[:, :rank], s[:rank]
+
+#----------------------------------------------------------------------------
+def incremental_svd(chunks, tol, max_size=None):
+    """ Streaming SVD (Brand, https://doi.org/10.1016/j.laa.2005.07.021).
+    Updates the left singular vectors and singular values with each block
+    of columns from chunks, truncating with get_basis_size after every
+    update. Only the current basis and one block are held in memory.
+
+    chunks: iterable of (times x n) blocks of training waveforms, for eg.
+        iter_column_chunks(training_data_aligned, 100), or a generator that
+        produces the waveforms on the fly.
+    """
+    u = None
+    for C in chunks:
+        C = np.asarray(C)
+        if C.ndim == 1:
+            C = C[:, None]
+
+        if u is None:
+            u, s, _ = np.linalg.svd(C, full_matrices=False)
+        else:
+            # Split C into its component in span(u) and the residual. The
+            # projection is done twice, else the residual loses
+            # orthogonality to u when it is small.
+            uh = u.conjugate().transpose()
+            P = np.dot(uh, C)
+            residual = C - np.dot(u, P)
+            P2 = np.dot(uh, residual)
+            residual -= np.dot(u, P2)
+            P += P2
+            Q, R = np.linalg.qr(residual)
+
+            size = len(s)
+            K = np.zeros((size + R.shape[0], size + C.shape[1]), \
+                dtype=np.result_type(P, R))
+            K[:size, :size] = np.diag(s)
+            K[:size, size:] = P
+            K[size:, size:] = R
+            u_small, s, _ = np.linalg.svd(K, full_matrices=False)
+            u = np.dot(np.hstack([u, Q]), u_small)
+
+        size = get_basis_size(s, tol, max_size)
+        u = u[:, :size]
+        s = s[:size]
+
+    return u, s
+
+#----------------------------------------------------------------------------
+def build_basis(training_data, tol=1e-4, max_size=None, method='svd', \
+        chunk_size=500, seed=None):
+    """ Reduced basis for the training data. The basis size is set by the
+    tolerance: all singular vectors with s[i] > tol*s[0] are kept, up to
+    max_size of them.
+
+    training_data: (times x samples) matrix of training waveforms. Can be
+        memory-mapped for the 'randomized' and 'incremental' methods. For
+        'incremental', this can also be an iterable of blocks of columns.
+    method:
+        'svd': dense numpy SVD. Needs the whole matrix in memory.
+        'randomized': randomized_svd, doubling the rank until the
+            tolerance is reached.
+        'incremental': incremental_svd, one pass over the data.
+
+    Returns the basis as a (times x basis_size) matrix and the singular
+    values.
+    """
+    if method == 'svd':
+        u, s, _ = np.linalg.svd(training_data, full_matrices=False)
+    elif method == 'randomized':
+        num_cols = training_data.shape[1]
+        rank = min(16, num_cols)
+        while True:
+            u, s = randomized_svd(training_data, rank, chunk_size=chunk_size, \
+                seed=seed)
+            if rank == num_cols or s[-1] <= tol*s[0] \
+                    or (max_size is not None and rank >= max_size):
+                break
+            rank = min(2*rank, num_cols)
+    elif method == 'incremental':
+        if hasattr(training_data, 'shape'):
+            training_data = iter_column_chunks(training_data, chunk_size)
+        u, s = incremental_svd(training_data, tol, max_size=max_size)
+    else:
+        raise Exception('Invalid method %s'%method)
+
+    basis_size = get_basis_size(s, tol, max_size)
+    return u[:, :basis_size], s
+
+#----------------------------------------------------------------------------
+class EmpiricalInterpolant(object):
+    """ Empirical interpolant of a (real or complex) basis, with the same
+    interface as rompy's EmpiricalInterpolant.
+
+    basis: (basis_size x times) matrix, the basis vectors are the rows.
+        Note that this is the transpose of build_basis's output.
+
+    Attributes:
+    indices: the EIM nodes, as indices into the time grid.
+    B: (basis_size x times) interpolation matrix, such that a waveform h in
+        the span of the basis is h = np.dot(B.transpose(), h[indices]).
+    errors: errors[j] is the max error of interpolating basis vector j
+        with the first j nodes, which is the value that selected node j.
+    timings: wall time in seconds of each greedy step.
+
+    The nodes are selected greedily. The residual of basis vector j vanishes
+    at the previous nodes, so in the basis of residuals the interpolation
+    system is lower triangular, and each step only adds a row to it instead
+    of solving the system from scratch.
+    """
+
+    def __init__(self, basis, verbose=False):
+        basis = np.asarray(basis)
+        basis_size = basis.shape[0]
+
+        self.indices = np.zeros(basis_size, dtype=int)
+        self.errors = np.zeros(basis_size)
+        self.timings = np.zeros(basis_size)
+
+        # Residual basis, normalized to be 1 at its own node
+        R = np.empty_like(basis)
+        # L[i, k] = R[k, indices[i]], lower triangular with unit diagonal
+        L = np.zeros((basis_size, basis_size), dtype=basis.dtype)
+
+        for j in range(basis_size):
+            start = time.time()
+
+            residual = np.array(basis[j])
+            if j > 0:
+                coefs = solve_triangular(L[:j, :j], \
+                    basis[j, self.indices[:j]], lower=True, \
+                    unit_diagonal=True)
+                residual -= np.dot(coefs, R[:j])
+
+            idx = np.argmax(np.abs(residual))
+            self.indices[j] = idx
+            self.errors[j] = np.abs(residual[idx])
+            R[j] = residual/residual[idx]
+            L[j, :j+1] = R[:j+1, idx]
+
+            self.timings[j] = time.time() - start
+            if verbose:
+                print("Step %i: node %i, interpolation error %e, %.3e s"%( \
+                    j, idx, self.errors[j], self.timings[j]))
+
+        # h = sum_k a_k R[k] with np.dot(L, a) = h[indices], therefore
+        # B = L^{-T} R
+        self.B = solve_triangular(L, R, trans='T', lower=True, \
+            unit_diagonal=True, overwrite_b=True)
+
+#----------------------------------------------------------------------------
+def fit_eim_nodes(qs, h_training_eim, degree=2):
+    """ Spline interpolants in q of the real and imaginary parts of the
+    waveform at each EIM node, as in the notebook's splrep fits.
+
+    h_training_eim: (nodes x samples) waveform values at the EIM nodes.
+
+    All the splines share the same knots, as they interpolate on the same qs,
+    so they are returned stacked: the knots, and a
+    (num_coefs x 2*nodes) matrix whose first (last) nodes columns hold the
+    coefficients for the real (imaginary) parts. For real data only the
+    real parts are fit, and the matrix is (num_coefs x nodes).
+    """
+    num_nodes = h_training_eim.shape[0]
+    if np.iscomplexobj(h_training_eim):
+        parts = [np.real(h_training_eim), np.imag(h_training_eim)]
+    else:
+        parts = [h_training_eim]
+
+    knots = None
+    coefs = []
+    for data in parts:
+        for idx in range(num_nodes):
+            t, c, k = splrep(qs, data[idx], k=degree)
+            if knots is None:
+                knots = t
+            elif not np.array_equal(knots, t):
+                raise Exception('Spline knots differ between EIM nodes')
+            # splrep pads the coefficients with degree+1 zeros
+            coefs.append(c[:len(t) - degree - 1])
+    return knots, np.array(coefs).transpose()
+
+#----------------------------------------------------------------------------
+def build_surrogate(qs, training_data_aligned, times, eim, degree=2, \
+        dtype=None):
+    """ Builds the Surrogate1D from the aligned training data and an
+    EmpiricalInterpolant (ours or rompy's) of the basis.
+
+    dtype: If given, the basis is stored with this dtype, for eg.
+        np.complex64 for single precision evaluation. Default: the dtype of
+        eim.B.
+    """
+    eim_indices = np.asarray(eim.indices)
+    knots, coefs = fit_eim_nodes(qs, training_data_aligned[eim_indices, :], \
+        degree=degree)
+    provenance = {
+        'created': datetime.datetime.now().isoformat(),
+        'num_training_samples': len(qs),
+        'q_min': float(np.min(qs)),
+        'q_max': float(np.max(qs)),
+        'basis_size': len(eim_indices),
+        }
+    B = np.asarray(eim.B)
+    if dtype is not None:
+        B = B.astype(dtype)
+    provenance['dtype'] = B.dtype.name
+    return Surrogate1D(times, B, eim_indices, knots, coefs, degree, \
+        provenance=provenance)
+
+#----------------------------------------------------------------------------
+def build_multimode_surrogate(qs, training_sets, dt, tol=1e-4, degree=2, \
+        basis_method='svd', dtype=complex, verbose=False):
+    """ Builds a MultiModeSurrogate1D, with a basis, empirical interpolant
+    and fits for each mode.
+
+    training_sets: dict of the training data of each mode, keyed by
+        (ell, emm), in the order of qs. For eg. eob_training.TrainingSet
+        with each mode of a training set generated with all_modes=True.
+    dt: time step of the waveforms.
+    basis_method: method of build_basis.
+    dtype: dtype of the aligned training data and the bases.
+
+    All modes are aligned by the peaks of the (2,2) mode, and share a time
+    grid.
+    """
+    modes = sorted(training_sets.keys())
+    ref_mode = (2, 2) if (2, 2) in training_sets else modes[0]
+    peak_idx = get_peaks(training_sets[ref_mode])
+
+    mode_surs = {}
+    for mode in modes:
+        times, training_data_aligned, _ = align_and_pad(training_sets[mode], \
+            dt, dtype=dtype, peak_idx=peak_idx)
+        basis, s = build_basis(training_data_aligned, tol=tol, \
+            method=basis_method)
+        eim = EmpiricalInterpolant(basis.transpose())
+        mode_surs[mode] = build_surrogate(qs, training_data_aligned, times, \
+            eim, degree=degree)
+        if verbose:
+            print('Mode %s: basis size %d'%(mode, len(eim.indices)))
+        del training_data_aligned
+
+    provenance = {
+        'created': datetime.datetime.now().isoformat(),
+        'num_training_samples': len(qs),
+        'q_min': float(np.min(qs)),
+        'q_max': float(np.max(qs)),
+        }
+    return MultiModeSurrogate1D(times, mode_surs, provenance=provenance)
+
+#----------------------------------------------------------------------------
+def get_amp_phase(training_data_aligned):
+    """ Amplitude and unwrapped phase, h = amp*exp(1j*phase), of each
+    training waveform. The phase is unwrapped in time for each waveform,
+    one at a time, and the phase at the first sample is then also unwrapped
+    across the training set, so that the phase is continuous in q.
+    """
+    amp = np.abs(training_data_aligned)
+    phase = np.empty(training_data_aligned.shape)
+    for idx in range(phase.shape[1]):
+        phase[:, idx] = np.unwrap(np.angle(training_data_aligned[:, idx]))
+    phase += np.unwrap(phase[0]) - phase[0]
+    return amp, phase
+
+#----------------------------------------------------------------------------
+def get_sparse_time_indices(times, amp_ref, phase_ref, amp_tol=1e-6, \
+        phase_tol=1e-6, num_initial=16):
+    """ Indices into times of a sparse grid, from which the cubic
+    interpolation used by AmpPhaseSurrogate1D reconstructs amp_ref to
+    within amp_tol (relative to its maximum) and phase_ref to within
+    phase_tol (in radians) at every sample of times.
+
+    Starting from num_initial uniformly spaced indices, every interval in
+    which either tolerance is not met is split in two, until all intervals
+    meet them. This is sparse in the early inspiral and dense near the
+    merger and in the ringdown. The first and last indices are always
+    included.
+    """
+    num_times = len(times)
+    amp_scale = np.max(np.abs(amp_ref))
+    sparse_idx = np.unique(np.linspace(0, num_times - 1, \
+        max(num_initial, 2)).astype(int))
+
+    while True:
+        sparse_times = times[sparse_idx]
+        amp_err = np.abs(cubic_interp(times, sparse_times, \
+            amp_ref[sparse_idx]) - amp_ref)/amp_scale
+        phase_err = np.abs(cubic_interp(times, sparse_times, \
+            phase_ref[sparse_idx]) - phase_ref)
+        bad = (amp_err > amp_tol) | (phase_err > phase_tol)
+        if not np.any(bad):
+            return sparse_idx
+
+        # Split the intervals that contain a sample that fails
+        interval = np.searchsorted(sparse_idx, np.nonzero(bad)[0]) - 1
+        interval = np.unique(np.clip(interval, 0, len(sparse_idx) - 2))
+        midpoints = (sparse_idx[interval] + sparse_idx[interval+1])//2
+        sparse_idx = np.union1d(sparse_idx, midpoints)
+
+#----------------------------------------------------------------------------
+def build_amp_phase_surrogate(qs, training_data_aligned, times, \
+        sparse_amp_tol=1e-6, sparse_phase_tol=1e-6, amp_tol=1e-6, \
+        phase_tol=1e-10, degree=2, basis_method='svd'):
+    """ Builds an AmpPhaseSurrogate1D. Instead of the oscillatory h, the
+    amplitude and phase are modeled, each with its own basis, empirical
+    interpolant and spline fits. As these are smooth, they are sampled
+    on the sparse grid of get_sparse_time_indices instead of every time
+    sample.
+
+    sparse_amp_tol, sparse_phase_tol: tolerances of get_sparse_time_indices,
+        for the reference training waveform, the one with the most cycles.
+
+    The zero padding at the end of the aligned waveforms is dropped: the
+    model covers the times at which all training waveforms are nonzero,
+    and is zero after that.
+
+    amp_tol, phase_tol: tolerances for build_basis of the amplitude and
+        phase. The phase is much larger than the amplitude, and needs a
+        smaller relative tolerance.
+    """
+    # Last sample at which all waveforms are nonzero
+    nonzero = np.abs(training_data_aligned) > 0
+    last_nonzero = nonzero.shape[0] - 1 - np.argmax(nonzero[::-1], axis=0)
+    num_valid = np.min(last_nonzero) + 1
+
+    amp, phase = get_amp_phase(training_data_aligned[:num_valid])
+
+    # Reference waveform with the most cycles
+    ref_idx = np.argmax(np.abs(phase[-1] - phase[0]))
+    sparse_idx = get_sparse_time_indices(times[:num_valid], amp[:, ref_idx], \
+        phase[:, ref_idx], amp_tol=sparse_amp_tol, \
+        phase_tol=sparse_phase_tol)
+    sparse_times = times[sparse_idx]
+
+    components = []
+    for data, tol in [(amp[sparse_idx], amp_tol), \
+            (phase[sparse_idx], phase_tol)]:
+        basis, s = build_basis(data, tol=tol, method=basis_method)
+        eim = EmpiricalInterpolant(basis.transpose())
+        components.append(build_surrogate(qs, data, sparse_times, eim, \
+            degree=degree))
+    amp_sur, phase_sur = components
+
+    provenance = dict(amp_sur.provenance)
+    provenance.pop('basis_size')
+    provenance['amp_basis_size'] = len(amp_sur.eim_indices)
+    provenance['phase_basis_size'] = len(phase_sur.eim_indices)
+    provenance['num_sparse_times'] = len(sparse_times)
+    return AmpPhaseSurrogate1D(times, amp_sur, phase_sur, \
+        provenance=provenance)
+
+#----------------------------------------------------------------------------
+def _get_datasets(sur, prefix=''):
+    """ The arrays of a Surrogate1D to save, keyed by dataset name.
+    """
+    return {
+        prefix + 'B': np.ascontiguousarray(sur.B),
+        prefix + 'times': np.asarray(sur.times, dtype=float),
+        prefix + 'eim_indices': np.asarray(sur.eim_indices, dtype=np.int64),
+        prefix + 'knots': np.asarray(sur.knots, dtype=float),
+        prefix + 'coefs': np.ascontiguousarray(sur.coefs, dtype=float),
+        }
+
+#----------------------------------------------------------------------------
+def save_surrogate(sur, filename, **provenance):
+    """ Saves a Surrogate1D, AmpPhaseSurrogate1D or MultiModeSurrogate1D to
+    an HDF5 file, which can be loaded with surrogate_1d_loader.load_surrogate.
+
+    provenance: extra metadata to store along with sur.provenance, for eg.
+        the training set file or the EOB settings. Values must be JSON
+        serializable.
+    """
+    provenance = dict(sur.provenance, **provenance)
+    if isinstance(sur, AmpPhaseSurrogate1D):
+        datasets = {'times': np.asarray(sur.times, dtype=float)}
+        datasets.update(_get_datasets(sur.amp_sur, prefix='amp/'))
+        datasets.update(_get_datasets(sur.phase_sur, prefix='phase/'))
+        degree = sur.amp_sur.degree
+    elif isinstance(sur, MultiModeSurrogate1D):
+        datasets = {'times': np.asarray(sur.times, dtype=float)}
+        for mode in sur.modes:
+            datasets.update(_get_datasets(sur.mode_surs[mode], \
+                prefix='%s/'%get_mode_name(*mode)))
+        degree = sur.mode_surs[sur.modes[0]].degree
+    else:
+        datasets = _get_datasets(sur)
+        degree = sur.degree
+
+    with h5py.File(filename, 'w', userblock_size=USERBLOCK_SIZE) as f:
+        for name in datasets.keys():
+            # Contiguous storage, so that the loader can memory-map it
+            f.create_dataset(name, data=datasets[name])
+        f.attrs['model'] = type(sur).__name__
+        f.attrs['degree'] = degree
+        f.attrs['provenance'] = json.dumps(provenance)
+
+    header = {
+        'format': FORMAT_NAME,
+        'version': FORMAT_VERSION,
+        'model': type(sur).__name__,
+        'degree': int(degree),
+        'provenance': provenance,
+        'datasets': {},
+        }
+    if isinstance(sur, MultiModeSurrogate1D):
+        header['modes'] = [list(mode) for mode in sur.modes]
+    with h5py.File(filename, 'r') as f:
+        for name in datasets.keys():
+            header['datasets'][name] = {
+                'offset': int(f[name].id.get_offset()),
+                'dtype': datasets[name].dtype.str,
+                'shape': list(datasets[name].shape),
+                }
+
+    header = json.dumps(header).encode('ascii')
+    if len(header) > USERBLOCK_SIZE:
+        raise Exception('Surrogate header does not fit in the userblock')
+    with open(filename, 'r+b') as f:
+        f.write(header.ljust(USERBLOCK_SIZE, b' '))
@@ -0,0 +1,358 @@
+__doc__ = """surrogate_1d_loader
+===================
+
+Lightweight loader and evaluator for 1D surrogates saved with
+surrogate_1d.save_surrogate. Only needs numpy.
+
+The surrogate files are HDF5 files, readable with h5py, whose datasets are
+stored contiguously. A small JSON header in the HDF5 userblock (the first
+USERBLOCK_SIZE bytes of the file) records the byte offset, dtype and shape
+of each dataset, so that this module can memory-map them directly.
+
+Usage:
+import surrogate_1d_loader
+sur = surrogate_1d_loader.load_surrogate('EOBNRv2_1d_surrogate.h5')
+h = sur(1.5)
+"""
+
+import numpy as np
+import json
+
+USERBLOCK_SIZE = 4096
+FORMAT_NAME = 'Surrogate1D'
+FORMAT_VERSION = 3
+
+
+#----------------------------------------------------------------------------
+def eval_stacked_bspline(knots, coefs, degree, x):
+    """ Evaluates the splines with the given knots and coefficient columns
+    coefs (num_coefs x num_splines) at the points x, using de Boor's
+    algorithm. Outside the base interval the end polynomial pieces are
+    extrapolated, like scipy's BSpline and splev.
+
+    Returns a (len(x) x num_splines) array.
+    """
+    x = np.atleast_1d(np.asarray(x, dtype=float))
+    num_coefs = coefs.shape[0]
+
+    # Knot interval of each x, clipped to the base interval
+    mu = np.searchsorted(knots, x, side='right') - 1
+    mu = np.clip(mu, degree, num_coefs - 1)
+
+    d = np.array([coefs[mu - degree + j] for j in range(degree + 1)])
+    for r in range(1, degree + 1):
+        for j in range(degree, r - 1, -1):
+            left = knots[mu - degree + j]
+            right = knots[mu + 1 + j - r]
+            alpha = ((x - left)/(right - left))[:, None]
+            d[j] = (1 - alpha)*d[j-1] + alpha*d[j]
+    return d[degree]
+
+#----------------------------------------------------------------------------
+class Surrogate1D(object):
+    """ The 1D surrogate h(t; q) = sum_i h(T_i; q) B_i(t), with splines in q
+    for h(T_i; q). Built by surrogate_1d.build_surrogate, or loaded with
+    load_surrogate.
+
+    Usage:
+    h = sur(1.5)                        # (times,)
+    h = sur(qs)                         # (len(qs) x times)
+    h = sur(qs, chunk_size=100)         # same, 100 q values at a time
+    h = sur(qs, t_start=3.5)            # only at sur.times >= 3.5
+    h = sur(qs, times=t_new)            # only at the times t_new
+    sur32 = sur.astype(np.complex64)    # single precision copy
+
+    When only some times are requested, only the corresponding columns of
+    the basis are read, so the cost scales with the number of output
+    samples.
+
+    The outputs have the precision of the basis B. With a complex64 (or
+    float32 for real valued surrogates) basis the node values are rounded
+    to single precision and the evaluation uses single precision BLAS, which
+    halves the memory traffic. The spline coefficients are small, and are
+    always kept in double precision.
+    """
+
+    def __init__(self, times, B, eim_indices, knots, coefs, degree, \
+            provenance=None):
+        self.times = times
+        self.B = B
+        self.eim_indices = eim_indices
+        self.knots = knots
+        self.coefs = coefs
+        self.degree = degree
+        self.provenance = {} if provenance is None else provenance
+
+    def eval_nodes(self, q):
+        """ Waveform at the EIM nodes, (len(q) x nodes), for an array of q.
+        All nodes are evaluated together from the stacked coefficients.
+        """
+        vals = eval_stacked_bspline(self.knots, self.coefs, self.degree, q)
+        num_nodes = len(self.eim_indices)
+        if vals.shape[1] == num_nodes:
+            # Real valued surrogate
+            return vals
+        return vals[:, :num_nodes] + 1j*vals[:, num_nodes:]
+
+    def get_dtype(self):
+        """ dtype of the outputs.
+        """
+        if self.coefs.shape[1] == len(self.eim_indices):
+            return self.B.dtype
+        return np.result_type(self.B.dtype, np.complex64)
+
+    def astype(self, dtype):
+        """ Copy of the surrogate with the basis cast to dtype, for eg.
+        np.complex64 for single precision evaluation.
+        """
+        provenance = dict(self.provenance, dtype=np.dtype(dtype).name)
+        return Surrogate1D(self.times, np.asarray(self.B).astype(dtype), \
+            self.eim_indices, self.knots, self.coefs, self.degree, \
+            provenance=provenance)
+
+    def get_basis(self, times=None, t_start=None, t_end=None):
+        """ The basis, restricted to the requested times. See __call__.
+        """
+        if times is None:
+            return self.B[:, get_window(self.times, t_start, t_end)]
+
+        times = np.atleast_1d(np.asarray(times, dtype=float))
+        check_times(self.times, times)
+
+        # Grid samples needed for cubic interpolation to times
+        idx = np.clip(np.searchsorted(self.times, times, side='right') - 1, \
+            0, len(self.times) - 2)
+        if np.array_equal(self.times[idx], times):
+            return self.B[:, idx]
+        needed = np.unique(np.concatenate([idx-1, idx, idx+1, idx+2]))
+        needed = needed[(needed >= 0) & (needed < len(self.times))]
+        return cubic_interp(times, self.times[needed], \
+            np.asarray(self.B[:, needed])).astype(self.B.dtype, copy=False)
+
+    def __call__(self, q, chunk_size=None, times=None, t_start=None, \
+            t_end=None):
+        """ Evaluates the surrogate at a single q or an array of q. For an
+        array, chunk_size bounds the number of q values whose node values
+        are held in memory at once.
+
+        By default the surrogate is evaluated at all of self.times. Instead:
+        times: evaluate only at these times. Times between the samples of
+            self.times are cubic interpolated.
+        t_start, t_end: evaluate only at self.times in [t_start, t_end).
+        """
+        B = self.get_basis(times=times, t_start=t_start, t_end=t_end)
+        dtype = self.get_dtype()
+
+        if np.ndim(q) == 0:
+            return np.dot(self.eval_nodes([q])[0].astype(dtype), B)
+
+        q = np.asarray(q, dtype=float)
+        if chunk_size is None:
+            chunk_size = len(q)
+
+        h = np.empty((len(q), B.shape[1]), dtype=dtype)
+        for start in range(0, len(q), chunk_size):
+            # Same precision as B, so that np.dot doesn't upcast B
+            h_eim = self.eval_nodes(q[start:start+chunk_size]).astype(dtype)
+            h[start:start+chunk_size] = np.dot(h_eim, B)
+        return h
+
+#----------------------------------------------------------------------------
+def get_window(times, t_start=None, t_end=None):
+    """ Slice of times in [t_start, t_end).
+    """
+    start = None if t_start is None else np.searchsorted(times, t_start)
+    end = None if t_end is None else np.searchsorted(times, t_end)
+    return slice(start, end)
+
+#----------------------------------------------------------------------------
+def check_times(times, new_times):
+    """ Raises an Exception if any of new_times are outside times.
+    """
+    if np.min(new_times) < times[0] or np.max(new_times) > times[-1]:
+        raise Exception('Requested times outside [%g, %g]'%(times[0], \
+            times[-1]))
+
+#----------------------------------------------------------------------------
+def cubic_interp(x_new, x, y):
+    """ Cubic Hermite interpolation of the rows of y, sampled at the
+    increasing points x, to x_new. The derivatives at the nodes are second
+    order finite differences. x_new must lie within [x[0], x[-1]].
+
+    Returns an array of shape y.shape[:-1] + (len(x_new),).
+    """
+    h = np.diff(x)
+    delta = np.diff(y, axis=-1)/h
+
+    slope = np.empty(y.shape, dtype=delta.dtype)
+    slope[..., 1:-1] = (h[1:]*delta[..., :-1] + h[:-1]*delta[..., 1:]) \
+        /(h[:-1] + h[1:])
+    slope[..., 0] = delta[..., 0]
+    slope[..., -1] = delta[..., -1]
+
+    idx = np.clip(np.searchsorted(x, x_new, side='right') - 1, 0, len(x) - 2)
+    s = (x_new - x[idx])/h[idx]
+    return (1 + 2*s)*(1 - s)**2 * y[..., idx] \
+        + s*(1 - s)**2 * h[idx]*slope[..., idx] \
+        + s**2*(3 - 2*s) * y[..., idx+1] \
+        + s**2*(s - 1) * h[idx]*slope[..., idx+1]
+
+#----------------------------------------------------------------------------
+class AmpPhaseSurrogate1D(object):
+    """ The 1D surrogate h(t; q) = amp(t; q) exp(1j*phase(t; q)), where the
+    amplitude and phase are real valued Surrogate1Ds on a sparse time grid.
+    Built by surrogate_1d.build_amp_phase_surrogate, or loaded with
+    load_surrogate.
+
+    The amplitude and phase are interpolated from the sparse grid to times,
+    the time grid of the training data. The surrogate is zero after the end
+    of the sparse grid.
+
+    Has the same calling interface as Surrogate1D.
+    """
+
+    def __init__(self, times, amp_sur, phase_sur, provenance=None):
+        self.times = times
+        self.amp_sur = amp_sur
+        self.phase_sur = phase_sur
+        self.provenance = {} if provenance is None else provenance
+
+    def __call__(self, q, chunk_size=None, times=None, t_start=None, \
+            t_end=None):
+        """ Evaluates the surrogate at a single q or an array of q. For an
+        array, chunk_size bounds the number of q values evaluated at once.
+
+        By default the surrogate is evaluated at all of self.times. Instead:
+        times: evaluate only at these times.
+        t_start, t_end: evaluate only at self.times in [t_start, t_end).
+        """
+        if np.ndim(q) == 0:
+            return self([q], times=times, t_start=t_start, t_end=t_end)[0]
+
+        q = np.asarray(q, dtype=float)
+        if chunk_size is None:
+            chunk_size = len(q)
+
+        if times is None:
+            times = self.times[get_window(self.times, t_start, t_end)]
+        else:
+            times = np.atleast_1d(np.asarray(times, dtype=float))
+            check_times(self.times, times)
+
+        sparse_times = self.amp_sur.times
+        valid = times <= sparse_times[-1]
+        valid_times = times[valid]
+
+        h = np.zeros((len(q), len(times)), dtype=complex)
+        for start in range(0, len(q), chunk_size):
+            q_chunk = q[start:start+chunk_size]
+            amp = cubic_interp(valid_times, sparse_times, \
+                self.amp_sur(q_chunk))
+            phase = cubic_interp(valid_times, sparse_times, \
+                self.phase_sur(q_chunk))
+            h[start:start+chunk_size, valid] = amp*np.exp(1j*phase)
+        return h
+
+#----------------------------------------------------------------------------
+def get_mode_name(ell, emm):
+    """ Name of the (ell, emm) mode in surrogate files. Same as
+    eob_training.get_mode_name.
+    """
+    return 'l%d_m%d'%(ell, emm)
+
+#----------------------------------------------------------------------------
+class MultiModeSurrogate1D(object):
+    """ A Surrogate1D for each mode, on a common time grid. Built by
+    surrogate_1d.build_multimode_surrogate, or loaded with load_surrogate.
+
+    Usage:
+    h = sur(1.5)                        # dict of (times,), keyed by (l, m)
+    h = sur(1.5, modes=[(2, 2), (3, 3)])
+    h = sur(qs, t_start=3.5)            # dict of (len(qs) x times)
+
+    Takes the same keyword arguments as Surrogate1D, which are passed on to
+    each mode.
+    """
+
+    def __init__(self, times, mode_surs, provenance=None):
+        self.times = times
+        self.mode_surs = mode_surs
+        self.modes = sorted(mode_surs.keys())
+        self.provenance = {} if provenance is None else provenance
+
+    def __call__(self, q, modes=None, **kwargs):
+        """ Evaluates the modes, all of them if modes is None.
+        """
+        if modes is None:
+            modes = self.modes
+        return dict((mode, self.mode_surs[tuple(mode)](q, **kwargs)) \
+            for mode in modes)
+
+#----------------------------------------------------------------------------
+def read_header(filename):
+    """ Reads the JSON header from the userblock of a surrogate file.
+    """
+    with open(filename, 'rb') as f:
+        header = f.read(USERBLOCK_SIZE)
+    header = json.loads(header.rstrip(b'\0 ').decode('ascii'))
+    if header.get('format') != FORMAT_NAME:
+        raise Exception('%s is not a %s file'%(filename, FORMAT_NAME))
+    if header['version'] > FORMAT_VERSION:
+        raise Exception('%s has format version %d, but only versions <= %d' \
+            ' are supported'%(filename, header['version'], FORMAT_VERSION))
+    return header
+
+#----------------------------------------------------------------------------
+def load_dataset(filename, header, name, mmap=True):
+    """ Returns the dataset name of the surrogate file, memory-mapped if
+    mmap is True, else read into memory.
+    """
+    info = header['datasets'][name]
+    dtype = np.dtype(info['dtype'])
+    shape = tuple(info['shape'])
+    if mmap and np.prod(shape) > 0:
+        return np.memmap(filename, mode='r', dtype=dtype, \
+            offset=info['offset'], shape=shape)
+    return np.fromfile(filename, dtype=dtype, count=int(np.prod(shape)), \
+        offset=info['offset']).reshape(shape)
+
+#----------------------------------------------------------------------------
+def _load_component(filename, header, prefix='', mmap_basis=True):
+    """ Loads the Surrogate1D whose datasets have names starting with prefix.
+    """
+    B = load_dataset(filename, header, prefix + 'B', mmap=mmap_basis)
+    times = load_dataset(filename, header, prefix + 'times', mmap=False)
+    eim_indices = load_dataset(filename, header, prefix + 'eim_indices', \
+        mmap=False)
+    knots = load_dataset(filename, header, prefix + 'knots', mmap=False)
+    coefs = load_dataset(filename, header, prefix + 'coefs', mmap=False)
+    return Surrogate1D(times, B, eim_indices, knots, coefs, header['degree'])
+
+#----------------------------------------------------------------------------
+def load_surrogate(filename, mmap_basis=True):
+    """ Loads a surrogate saved with surrogate_1d.save_surrogate. The bases,
+    which are the only large arrays, are memory-mapped unless mmap_basis is
+    False.
+    """
+    header = read_header(filename)
+    model = header.get('model', 'Surrogate1D')
+    if model == 'Surrogate1D':
+        sur = _load_component(filename, header, mmap_basis=mmap_basis)
+    elif model == 'AmpPhaseSurrogate1D':
+        times = load_dataset(filename, header, 'times', mmap=False)
+        amp_sur = _load_component(filename, header, prefix='amp/', \
+            mmap_basis=mmap_basis)
+        phase_sur = _load_component(filename, header, prefix='phase/', \
+            mmap_basis=mmap_basis)
+        sur = AmpPhaseSurrogate1D(times, amp_sur, phase_sur)
+    elif model == 'MultiModeSurrogate1D':
+        times = load_dataset(filename, header, 'times', mmap=False)
+        mode_surs = {}
+        for mode in header['modes']:
+            mode_surs[tuple(mode)] = _load_component(filename, header, \
+                prefix='%s/'%get_mode_name(*mode), mmap_basis=mmap_basis)
+        sur = MultiModeSurrogate1D(times, mode_surs)
+    else:
+        raise Exception('Unknown surrogate model %s'%model)
+    sur.provenance = header['provenance']
+    return sur
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+__doc__ = """surrogate_1d_roq
+================
+
+Reduced-order quadrature (ROQ) for the 1D surrogate of
+ICERM-build-1d-model.ipynb, for likelihoods in parameter estimation.
+
+With the inner product <a, b> = dt sum_t w(t) conj(a(t)) b(t), for noise
+weights w (1 for white noise), the log likelihood of data d is, up to a
+constant,
+    log L(q) = Re <d, h(q)> - <h(q), h(q)>/2.
+Evaluated directly, each call needs the full-length waveform h(q).
+
+Linear term: h(t; q) = sum_i h(T_i; q) B_i(t), so
+    <d, h(q)> = sum_i h(T_i; q) omega_i,  omega_i = dt sum_t w conj(d) B_i
+Quadratic term: |h(t; q)|^2 is real and smooth, and gets its own empirical
+interpolant, with nodes T'_j and basis B'_j(t), so
+    <h(q), h(q)> = sum_j |h(T'_j; q)|^2 psi_j,  psi_j = dt sum_t w B'_j
+The weights omega and psi are precomputed once per data set, after which
+each likelihood call costs O(nodes^2), independent of the waveform length.
+
+Example usage:
+./surrogate_1d_roq.py --training_data data/1D_EOBNRv2/training_data.h5
+"""
+
+import numpy as np
+import argparse
+import time
+
+import surrogate_1d
+
+
+#----------------------------------------------------------------------------
+def build_quadratic_interpolant(training_data_aligned, tol=1e-8, \
+        max_size=None, basis_method='svd'):
+    """ EmpiricalInterpolant of |h|^2 from the aligned training data, for
+    the quadratic term. Only depends on the training set, so it can be
+    built once along with the surrogate.
+    """
+    training_data_quad = np.abs(training_data_aligned)**2
+    basis, s = surrogate_1d.build_basis(training_data_quad, tol=tol, \
+        max_size=max_size, method=basis_method)
+    return surrogate_1d.EmpiricalInterpolant(basis.transpose())
+
+#----------------------------------------------------------------------------
+def inner_product(a, b, dt, weights=None):
+    """ <a, b> = dt sum_t w(t) conj(a(t)) b(t), along the last axis.
+    """
+    if weights is None:
+        return dt*np.dot(b, np.conj(a))
+    return dt*np.dot(b, np.conj(a)*weights)
+
+#----------------------------------------------------------------------------
+class ROQ(object):
+    """ Reduced-order quadrature rule for the likelihood of the data d with
+    a Surrogate1D.
+
+    Usage:
+    quad_eim = build_quadratic_interpolant(training_data_aligned)
+    roq = ROQ(sur, quad_eim, d, dt)
+    d_h, h_h = roq.inner_products(qs)       # <d, h(q)>, <h(q), h(q)>
+    logL = roq.log_likelihood(qs)
+    """
+
+    def __init__(self, sur, quad_eim, data, dt, weights=None):
+        """ sur: Surrogate1D.
+        quad_eim: EmpiricalInterpolant of |h|^2, from
+            build_quadratic_interpolant.
+        data: data d on sur.times.
+        weights: noise weights w on sur.times. Default: 1.
+        """
+        self.sur = sur
+        self.quad_indices = np.asarray(quad_eim.indices)
+
+        # Linear weights omega_i, one per EIM node of the surrogate
+        self.linear_weights = inner_product(data, np.asarray(sur.B), dt, \
+            weights=weights)
+
+        # Quadratic weights psi_j, one per EIM node of |h|^2
+        quad_B = np.real(np.asarray(quad_eim.B))
+        if weights is None:
+            self.quadratic_weights = dt*np.sum(quad_B, axis=1)
+        else:
+            self.quadratic_weights = dt*np.dot(quad_B, weights)
+
+        # Surrogate basis at the quadratic nodes, so that h(T'_j; q) follows
+        # from the surrogate node values.
+        self.B_quad = np.asarray(sur.B[:, self.quad_indices])
+
+    def inner_products(self, q):
+        """ <d, h(q)> and <h(q), h(q)>, for a single q or an array of q.
+        """
+        h_eim = self.sur.eval_nodes(np.atleast_1d(q))
+        d_h = np.dot(h_eim, self.linear_weights)
+        h_quad = np.abs(np.dot(h_eim, self.B_quad))**2
+        h_h = np.dot(h_quad, self.quadratic_weights)
+        if np.ndim(q) == 0:
+            return d_h[0], h_h[0]
+        return d_h, h_h
+
+    def log_likelihood(self, q):
+        """ Re <d, h(q)> - <h(q), h(q)>/2.
+        """
+        d_h, h_h = self.inner_products(q)
+        return np.real(d_h) - 0.5*h_h
+
+#----------------------------------------------------------------------------
+def brute_force_inner_products(sur, q, data, dt, weights=None):
+    """ <d, h(q)> and <h(q), h(q)> from the full-length surrogate waveform,
+    for checking and benchmarking ROQ.inner_products.
+    """
+    h = sur(q)
+    return inner_product(data, h, dt, weights=weights), \
+        np.real(inner_product(h, h, dt, weights=weights))
+
+#----------------------------------------------------------------------------
+def benchmark_roq(roq, sur, qs, data, dt, weights=None):
+    """ Times ROQ.inner_products against brute_force_inner_products, one q
+    at a time as in a sampler, and returns the time per call of each, and
+    the largest relative errors of the ROQ linear and quadratic terms.
+    """
+    start = time.perf_counter()
+    roq_vals = [roq.inner_products(q) for q in qs]
+    roq_time = (time.perf_counter() - start)/len(qs)
+
+    start = time.perf_counter()
+    brute_vals = [brute_force_inner_products(sur, q, data, dt, \
+        weights=weights) for q in qs]
+    brute_time = (time.perf_counter() - start)/len(qs)
+
+    roq_vals = np.array(roq_vals)
+    brute_vals = np.array(brute_vals)
+    scale = np.abs(brute_vals[:, 1])
+    linear_error = np.max(np.abs(roq_vals[:, 0] - brute_vals[:, 0])/scale)
+    quadratic_error = np.max(np.abs(roq_vals[:, 1] - brute_vals[:, 1])/scale)
+    return roq_time, brute_time, linear_error, quadratic_error
+
+
+#############################    main    ##################################
+if __name__ == '__main__':
+
+    import eob_training
+
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('--training_data', type=str, required=True,
+        help='Training set written by eob_training.')
+    parser.add_argument('--tol', type=float, default=1e-4,
+        help='Tolerance on the singular values for the surrogate basis.')
+    parser.add_argument('--quad_tol', type=float, default=1e-8,
+        help='Tolerance on the singular values for the |h|^2 basis.')
+    parser.add_argument('--q_true', type=float, default=1.5,
+        help='Mass ratio of the simulated data.')
+    parser.add_argument('--noise', type=float, default=0.1,
+        help='Standard deviation of the white noise added to the data, ' \
+            'relative to the peak amplitude.')
+    parser.add_argument('--num_eval', type=int, default=200,
+        help='Number of likelihood calls to time.')
+
+    args = parser.parse_args()
+
+    training_set = eob_training.TrainingSet(args.training_data)
+    qs = training_set.qs
+    dt = training_set.attrs['dt']
+    times, training_data_aligned, _ = surrogate_1d.align_and_pad( \
+        training_set, dt)
+    basis, s = surrogate_1d.build_basis(training_data_aligned, tol=args.tol)
+    eim = surrogate_1d.EmpiricalInterpolant(basis.transpose())
+    sur = surrogate_1d.build_surrogate(qs, training_data_aligned, times, eim)
+    quad_eim = build_quadratic_interpolant(training_data_aligned, \
+        tol=args.quad_tol)
+    print('Surrogate nodes: %d, quadratic nodes: %d, time samples: %d'%( \
+        len(eim.indices), len(quad_eim.indices), len(times)))
+
+    h_true = sur(args.q_true)
+    sigma = args.noise*np.max(np.abs(h_true))
+    data = h_true + sigma*(np.random.randn(len(times)) \
+        + 1j*np.random.randn(len(times)))
+
+    roq = ROQ(sur, quad_eim, data, dt)
+    q_eval = np.random.uniform(np.min(qs), np.max(qs), args.num_eval)
+    roq_time, brute_time, linear_error, quadratic_error = benchmark_roq(roq, \
+        sur, q_eval, data, dt)
+    print('ROQ: %.3e s per call, brute force: %.3e s per call, ' \
+        'speed-up %.1f'%(roq_time, brute_time, brute_time/roq_time))
+    print('Max relative error of <d,h>: %e, of <h,h>: %e'%(linear_error, \
+        quadratic_error))
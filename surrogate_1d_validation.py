@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+
+__doc__ = """surrogate_1d_validation
+=======================
+
+Validation of the 1D EOBNRv2 surrogate of ICERM-build-1d-model.ipynb.
+
+Two kinds of errors are computed, both as the relative max-norm error
+max|h - h_sur| / max|h| used in the notebook:
+- Leave-one-out errors: for each training sample, the surrogate is rebuilt
+  without it and evaluated at its q.
+- Held-out errors: the surrogate is compared against fresh EOBNRv2
+  waveforms at q values that are not in the training set. These are kept
+  in an eob_training.WaveformCache, so they are only generated once.
+
+With --single_precision, the held-out errors are those of the single
+precision (complex64) surrogate, and the error of rounding the surrogate
+to single precision, relative to the double precision one, is reported
+next to them. Single precision is fine as long as the rounding error is
+well below the model error.
+
+The folds and the EOBNRv2 evaluations are run in parallel.
+
+Example usage:
+./surrogate_1d_validation.py --training_data data/1D_EOBNRv2/training_data.h5
+    --cache_dir eob_cache --num_test 50 --report validation
+"""
+
+import numpy as np
+import argparse
+from multiprocessing import Pool
+import matplotlib.pyplot as P
+
+import surrogate_1d
+import eob_training
+from surrogate_1d import align_to_grid, relative_max_error
+from surrogate_1d_loader import Surrogate1D
+
+
+#----------------------------------------------------------------------------
+# Shared by the leave-one-out workers, set by _init_loo_worker.
+_loo_data = {}
+
+def _init_loo_worker(qs, training_data_aligned, times, tol, degree, eim):
+    _loo_data['qs'] = qs
+    _loo_data['training_data_aligned'] = training_data_aligned
+    _loo_data['times'] = times
+    _loo_data['tol'] = tol
+    _loo_data['degree'] = degree
+    _loo_data['eim'] = eim
+
+#----------------------------------------------------------------------------
+def _loo_error(idx):
+    """ Leave-one-out error of the idx-th training sample.
+    """
+    qs = _loo_data['qs']
+    training_data_aligned = _loo_data['training_data_aligned']
+    keep = np.arange(len(qs)) != idx
+
+    eim = _loo_data['eim']
+    if eim is None:
+        basis, s = surrogate_1d.build_basis(training_data_aligned[:, keep], \
+            tol=_loo_data['tol'])
+        eim = surrogate_1d.EmpiricalInterpolant(basis.transpose())
+
+    eim_indices = np.asarray(eim.indices)
+    knots, coefs = surrogate_1d.fit_eim_nodes(qs[keep], \
+        training_data_aligned[eim_indices][:, keep], \
+        degree=_loo_data['degree'])
+    sur = Surrogate1D(_loo_data['times'], eim.B, eim_indices, knots, coefs, \
+        _loo_data['degree'])
+
+    return relative_max_error(training_data_aligned[:, idx], sur(qs[idx]))
+
+#----------------------------------------------------------------------------
+def leave_one_out_errors(qs, training_data_aligned, times, tol=1e-4, \
+        degree=2, share_basis=True, num_procs=None):
+    """ Leave-one-out errors for each training sample.
+
+    The end points of the training set are skipped, as leaving them out
+    would test extrapolation. Their errors are set to nan.
+
+    share_basis: If True, the basis and empirical interpolant of the full
+        training set are shared by all folds, and only the fits are redone.
+        This is much cheaper, and measures the fitting error, but the
+        left out waveform still contributes to the basis. If False, the
+        basis and empirical interpolant are rebuilt for each fold.
+    """
+    qs = np.asarray(qs)
+    eim = None
+    if share_basis:
+        basis, s = surrogate_1d.build_basis(training_data_aligned, tol=tol)
+        eim = surrogate_1d.EmpiricalInterpolant(basis.transpose())
+
+    interior = [idx for idx in range(len(qs)) \
+        if qs[idx] != np.min(qs) and qs[idx] != np.max(qs)]
+
+    initargs = (qs, training_data_aligned, times, tol, degree, eim)
+    with Pool(num_procs, initializer=_init_loo_worker, \
+            initargs=initargs) as pool:
+        interior_errors = pool.map(_loo_error, interior)
+
+    errors = np.full(len(qs), np.nan)
+    errors[interior] = interior_errors
+    return errors
+
+#----------------------------------------------------------------------------
+def heldout_errors(sur, qs_test, cache, peak_idx, num_procs=None, \
+        **eob_kwargs):
+    """ Errors of the surrogate sur against EOBNRv2 at qs_test.
+
+    cache: eob_training.WaveformCache for the EOBNRv2 waveforms.
+    peak_idx: peak index of the aligned training data.
+    eob_kwargs: passed to EOBNRv2_LAL_modes, must match the training set.
+    """
+    h_test = cache.get_many(qs_test, num_procs=num_procs, **eob_kwargs)
+    num_times = len(sur.times)
+    h_test = np.array([align_to_grid(h, peak_idx, num_times) \
+        for h in h_test])
+    return relative_max_error(h_test, sur(np.asarray(qs_test)))
+
+#----------------------------------------------------------------------------
+def precision_errors(sur, qs, dtype=np.complex64):
+    """ Errors from evaluating the surrogate sur with its basis cast to
+    dtype, relative to evaluating it as is, at qs.
+    """
+    qs = np.asarray(qs)
+    return relative_max_error(sur(qs), sur.astype(dtype)(qs))
+
+#----------------------------------------------------------------------------
+def write_report(report, qs, loo_errors, qs_test, test_errors, \
+        single_errors=None):
+    """ Writes the errors to report.txt, and plots them against q in
+    report.png. single_errors are the precision_errors at qs_test, if
+    any.
+    """
+    with open('%s.txt'%report, 'w') as f:
+        f.write('# kind q relative_max_error\n')
+        for q, err in zip(qs, loo_errors):
+            f.write('leave_one_out %.12f %.6e\n'%(q, err))
+        for q, err in zip(qs_test, test_errors):
+            f.write('heldout %.12f %.6e\n'%(q, err))
+        if single_errors is not None:
+            for q, err in zip(qs_test, single_errors):
+                f.write('single_precision %.12f %.6e\n'%(q, err))
+
+    P.figure()
+    P.semilogy(qs, loo_errors, 'k*', label='leave one out')
+    P.semilogy(qs_test, test_errors, 'r+', label='held out')
+    if single_errors is not None:
+        P.semilogy(qs_test, single_errors, 'bx', label='single precision')
+    P.xlabel('q')
+    P.ylabel('relative max error')
+    P.legend()
+    P.savefig('%s.png'%report, bbox_inches='tight')
+    P.close()
+
+
+#############################    main    ##################################
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('--training_data', type=str, required=True,
+        help='Training set written by eob_training.')
+    parser.add_argument('--cache_dir', type=str, required=True,
+        help='Directory of the cache of held-out EOBNRv2 waveforms.')
+    parser.add_argument('--num_test', type=int, default=50,
+        help='Number of held-out q values, placed between the training ' \
+            'samples.')
+    parser.add_argument('--tol', type=float, default=1e-4,
+        help='Tolerance on the singular values for the basis.')
+    parser.add_argument('--rebuild_basis', default=False, action='store_true',
+        help='Rebuild the basis for each leave-one-out fold, instead of ' \
+            'sharing the basis of the full training set.')
+    parser.add_argument('--single_precision', default=False,
+        action='store_true', help='Validate the single precision ' \
+            'surrogate, and report its rounding error.')
+    parser.add_argument('--num_procs', type=int, default=None,
+        help='Number of worker processes. Default: number of cores.')
+    parser.add_argument('--report', type=str, default='validation',
+        help='Report is written to REPORT.txt and REPORT.png.')
+
+    args = parser.parse_args()
+
+    training_set = eob_training.TrainingSet(args.training_data)
+    qs = training_set.qs
+    eob_kwargs = {}
+    for key in ['Mtot', 'dt', 'fmin', 'Dist', 'ell', 'emm']:
+        if key in training_set.attrs:
+            eob_kwargs[key] = training_set.attrs[key].item()
+
+    times, training_data_aligned, peak_idx = surrogate_1d.align_and_pad( \
+        training_set, training_set.attrs['dt'])
+    peak_idx_aligned = np.min(peak_idx)
+
+    loo_errors = leave_one_out_errors(qs, training_data_aligned, times, \
+        tol=args.tol, share_basis=not args.rebuild_basis, \
+        num_procs=args.num_procs)
+
+    basis, s = surrogate_1d.build_basis(training_data_aligned, tol=args.tol)
+    eim = surrogate_1d.EmpiricalInterpolant(basis.transpose())
+    sur = surrogate_1d.build_surrogate(qs, training_data_aligned, times, eim)
+
+    # Held-out points between the training samples, avoiding the training
+    # samples themselves.
+    qs_sorted = np.sort(qs)
+    qs_test = np.linspace(qs_sorted[0], qs_sorted[-1], args.num_test + 2)[1:-1]
+    qs_test = qs_test[np.min(np.abs(qs_test[:, None] - qs_sorted[None, :]), \
+        axis=1) > 1e-8]
+    single_errors = None
+    if args.single_precision:
+        single_errors = precision_errors(sur, qs_test)
+        sur = sur.astype(np.complex64)
+
+    cache = eob_training.WaveformCache(args.cache_dir)
+    test_errors = heldout_errors(sur, qs_test, cache, peak_idx_aligned, \
+        num_procs=args.num_procs, **eob_kwargs)
+
+    write_report(args.report, qs, loo_errors, qs_test, test_errors, \
+        single_errors=single_errors)
+    print('Max leave-one-out error: %e'%np.nanmax(loo_errors))
+    print('Max held-out error: %e'%np.max(test_errors))
+    if single_errors is not None:
+        print('Max single precision rounding error: %e'%np.max(single_errors))
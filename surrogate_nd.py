@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+
+__doc__ = """surrogate_nd
+============
+
+Surrogates over several parameters, for eg. the aligned-spin (q, chi1z,
+chi2z) space, built the same way as the 1D surrogate of
+ICERM-build-1d-model.ipynb (aligned training data, SVD basis, empirical
+interpolation), but sampled and fit differently.
+
+A tensor product of n samples per parameter needs n^dim waveforms. Instead,
+the training set is a Smolyak sparse grid of nested Clenshaw-Curtis points,
+and the waveform at each EIM node is fit with the matching sparse grid
+polynomial interpolant. For 3 parameters, level 4 needs 177 waveforms
+where the tensor grid with the same 1D resolution needs 17^3 = 4913.
+
+Usage:
+grid = SparseGrid([1., -0.8, -0.8], [2., 0.8, 0.8], level=3)
+training_data = generate_training_set(grid.points, num_procs=8)
+sur = build_surrogate(grid, training_data, dt=1.0/2048.)
+h = sur([1.5, 0.2, -0.3])                   # (times,)
+h = sur(x)                                  # (len(x) x times)
+
+Example usage:
+./surrogate_nd.py --level 3 --num_procs 8 --checkpoint_dir ckpt_nd
+"""
+
+import numpy as np
+import os
+import argparse
+from itertools import product
+from multiprocessing import Pool
+from scipy.special import comb
+
+import surrogate_1d
+import eob_training
+from surrogate_1d import align_to_grid, relative_max_error
+
+
+#----------------------------------------------------------------------------
+def get_num_nodes(level):
+    """ Number of Clenshaw-Curtis nodes of a 1D level, starting from 1.
+    """
+    if level == 1:
+        return 1
+    return 2**(level - 1) + 1
+
+#----------------------------------------------------------------------------
+def get_cc_nodes(level):
+    """ Clenshaw-Curtis nodes of a 1D level, on [0, 1]. The nodes of each
+    level include those of the levels below it.
+    """
+    m = get_num_nodes(level)
+    if m == 1:
+        return np.array([0.5])
+    return 0.5*(1 - np.cos(np.pi*np.arange(m)/(m - 1)))
+
+#----------------------------------------------------------------------------
+def lagrange_matrix(x, level):
+    """ Values of the Lagrange polynomials of the nodes of a 1D level at
+    the points x in [0, 1], as a (len(x) x nodes) matrix. Uses the
+    barycentric formula, whose weights are known in closed form for
+    Chebyshev extreme points.
+    """
+    nodes = get_cc_nodes(level)
+    m = len(nodes)
+    if m == 1:
+        return np.ones((len(x), 1))
+
+    weights = (-1.)**np.arange(m)
+    weights[[0, -1]] *= 0.5
+
+    diff = x[:, None] - nodes[None, :]
+    exact = diff == 0
+    diff[exact] = 1
+    L = weights/diff
+    L /= np.sum(L, axis=1)[:, None]
+
+    # Points that are on a node
+    on_node = np.any(exact, axis=1)
+    L[on_node] = exact[on_node]
+    return L
+
+#----------------------------------------------------------------------------
+class SparseGrid(object):
+    """ Smolyak sparse grid of nested Clenshaw-Curtis points on the box
+    [lower, upper], and the sparse grid polynomial interpolant on it.
+
+    The interpolant is the combination technique sum of tensor product
+    interpolants on small anisotropic tensor grids, whose union is the
+    sparse grid:
+        sum_{level-dim < |i| - dim <= level} c_i U^{i_1} x ... x U^{i_dim}
+    with c_i = (-1)^(level + dim - |i|) binom(dim - 1, level + dim - |i|).
+
+    Attributes:
+    points: (num_points x dim) sparse grid points.
+    combination: list of (multi-index, coefficient) of the tensor grids.
+    """
+
+    def __init__(self, lower, upper, level):
+        self.lower = np.asarray(lower, dtype=float)
+        self.upper = np.asarray(upper, dtype=float)
+        self.level = level
+        self.dim = len(self.lower)
+
+        # Each point is labelled by its integer position on the 1D grid of
+        # the finest level, which is shared by all levels.
+        self.max_level = level + 1
+        num_finest = get_num_nodes(self.max_level)
+
+        self.combination = []
+        labels = {}
+        for idx in product(range(1, self.max_level + 1), repeat=self.dim):
+            norm = sum(idx)
+            if norm < max(self.dim, level + 1) or norm > level + self.dim:
+                continue
+            coef = (-1)**(level + self.dim - norm) \
+                * comb(self.dim - 1, level + self.dim - norm, exact=True)
+            self.combination.append((idx, coef))
+            for label in product(*[self._get_labels(i, num_finest) \
+                    for i in idx]):
+                if label not in labels:
+                    labels[label] = len(labels)
+
+        self._labels = labels
+        unit_points = get_cc_nodes(self.max_level)[np.array(list( \
+            labels.keys()), dtype=int)]
+        self.points = self.lower + (self.upper - self.lower)*unit_points
+
+    def _get_labels(self, level, num_finest):
+        m = get_num_nodes(level)
+        if m == 1:
+            return [(num_finest - 1)//2]
+        return list(np.arange(m)*((num_finest - 1)//(m - 1)))
+
+    def __len__(self):
+        return len(self.points)
+
+    def get_tensor_size(self):
+        """ Number of points of the full tensor grid with the same 1D
+        resolution.
+        """
+        return get_num_nodes(self.max_level)**self.dim
+
+    def interpolate(self, values, x):
+        """ Sparse grid interpolant of values, given at self.points, at the
+        points x.
+
+        values: (num_points x k) array.
+        x: (n x dim) array.
+
+        Returns an (n x k) array.
+        """
+        x = (np.atleast_2d(x) - self.lower)/(self.upper - self.lower)
+        num_finest = get_num_nodes(self.max_level)
+
+        result = np.zeros((len(x), values.shape[1]), dtype=values.dtype)
+        for idx, coef in self.combination:
+            rows = [self._labels[label] for label in \
+                product(*[self._get_labels(i, num_finest) for i in idx])]
+            shape = tuple(get_num_nodes(i) for i in idx)
+            tensor = values[rows].reshape(shape + (values.shape[1],))
+
+            # Contract one dimension at a time, the first one sets up the
+            # point axis n, the others are diagonal in n.
+            tensor = np.einsum('na,a...->n...', lagrange_matrix(x[:, 0], \
+                idx[0]), tensor)
+            for d in range(1, self.dim):
+                tensor = np.einsum('na,na...->n...', lagrange_matrix( \
+                    x[:, d], idx[d]), tensor)
+            result += coef*tensor
+        return result
+
+#----------------------------------------------------------------------------
+class SurrogateND(object):
+    """ The surrogate h(t; x) = sum_i h(T_i; x) B_i(t), with sparse grid
+    interpolants in the parameters x for h(T_i; x). Built by
+    build_surrogate.
+
+    Usage:
+    h = sur([1.5, 0.2, -0.3])               # (times,)
+    h = sur(x)                              # (len(x) x times)
+    h = sur(x, chunk_size=100)              # same, 100 points at a time
+    """
+
+    def __init__(self, times, B, eim_indices, grid, h_grid):
+        self.times = times
+        self.B = B
+        self.eim_indices = eim_indices
+        self.grid = grid
+        # Waveform at the EIM nodes, at the grid points, real and imaginary
+        # parts stacked, (num_points x 2*nodes)
+        self.h_grid = np.hstack([h_grid.real, h_grid.imag])
+
+    def eval_nodes(self, x):
+        """ Waveform at the EIM nodes, (len(x) x nodes).
+        """
+        vals = self.grid.interpolate(self.h_grid, x)
+        num_nodes = len(self.eim_indices)
+        return vals[:, :num_nodes] + 1j*vals[:, num_nodes:]
+
+    def __call__(self, x, chunk_size=None):
+        """ Evaluates the surrogate at a single point or an (n x dim) array
+        of points. chunk_size bounds the number of points whose node values
+        are held in memory at once.
+        """
+        dtype = np.result_type(self.B.dtype, np.complex64)
+        if np.ndim(x) == 1:
+            return np.dot(self.eval_nodes([x])[0].astype(dtype), self.B)
+
+        x = np.asarray(x, dtype=float)
+        if chunk_size is None:
+            chunk_size = len(x)
+
+        h = np.empty((len(x), self.B.shape[1]), dtype=dtype)
+        for start in range(0, len(x), chunk_size):
+            h_eim = self.eval_nodes(x[start:start+chunk_size]).astype(dtype)
+            h[start:start+chunk_size] = np.dot(h_eim, self.B)
+        return h
+
+#----------------------------------------------------------------------------
+def build_surrogate(grid, training_data, dt, tol=1e-4, basis_method='svd', \
+        dtype=complex):
+    """ Builds the SurrogateND from training waveforms at grid.points.
+
+    training_data: list of complex waveforms, in the order of grid.points.
+    dt: time step of the waveforms.
+    basis_method: method of surrogate_1d.build_basis.
+    dtype: dtype of the aligned training data and the basis.
+    """
+    times, training_data_aligned, _ = surrogate_1d.align_and_pad( \
+        training_data, dt, dtype=dtype)
+    basis, s = surrogate_1d.build_basis(training_data_aligned, tol=tol, \
+        method=basis_method)
+    eim = surrogate_1d.EmpiricalInterpolant(basis.transpose())
+    eim_indices = np.asarray(eim.indices)
+    h_grid = np.asarray(training_data_aligned[eim_indices, :]).transpose()
+    return SurrogateND(times, eim.B, eim_indices, grid, h_grid)
+
+#----------------------------------------------------------------------------
+def _generate_waveform(args):
+    """ Worker for generate_training_set. Returns the checkpointed waveform
+    if it exists, else evaluates SEOBNRv4 and checkpoints the result.
+    """
+    idx, x, eob_kwargs, checkpoint_dir = args
+
+    q, chi1z, chi2z = x
+
+    if checkpoint_dir is not None:
+        # Keyed on all the parameters, so that waveforms generated with
+        # other settings are never reused
+        key = eob_training._cache_key(q, dict(eob_kwargs, chi1z=chi1z, \
+            chi2z=chi2z, approximant='SEOBNRv4'))
+        fname = os.path.join(checkpoint_dir, 'h_%06d_%s.npy'%(idx, key))
+        if os.path.exists(fname):
+            return np.load(fname)
+
+    t, h = eob_training.SEOBNRv4_LAL(q=q, chi1z=chi1z, chi2z=chi2z, \
+        **eob_kwargs)
+
+    if checkpoint_dir is not None:
+        tmp_fname = '%s.tmp.npy'%fname[:-4]
+        np.save(tmp_fname, h)
+        os.replace(tmp_fname, fname)
+
+    return h
+
+#----------------------------------------------------------------------------
+def generate_training_set(points, num_procs=None, checkpoint_dir=None, \
+        **eob_kwargs):
+    """ Evaluates eob_training.SEOBNRv4_LAL at each (q, chi1z, chi2z) in
+    points, in parallel, with the same checkpointing as
+    eob_training.generate_training_set.
+
+    Returns the training data as a list of complex waveforms, in the same
+    order as points.
+    """
+    if checkpoint_dir is not None and not os.path.isdir(checkpoint_dir):
+        os.makedirs(checkpoint_dir)
+
+    tasks = [(idx, tuple(x), eob_kwargs, checkpoint_dir) \
+        for idx, x in enumerate(points)]
+    with Pool(num_procs) as pool:
+        return list(pool.imap(_generate_waveform, tasks))
+
+
+#############################    main    ##################################
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('--level', type=int, default=3,
+        help='Sparse grid level.')
+    parser.add_argument('--q_min', type=float, default=1.0,
+        help='Smallest mass ratio.')
+    parser.add_argument('--q_max', type=float, default=2.0,
+        help='Largest mass ratio.')
+    parser.add_argument('--chi_max', type=float, default=0.8,
+        help='Largest spin magnitude.')
+    parser.add_argument('--dt', type=float, default=1.0/2048.,
+        help='Time step.')
+    parser.add_argument('--tol', type=float, default=1e-4,
+        help='Tolerance on the singular values for the basis.')
+    parser.add_argument('--num_test', type=int, default=20,
+        help='Number of random points at which the surrogate is compared ' \
+            'to SEOBNRv4.')
+    parser.add_argument('--num_procs', type=int, default=None,
+        help='Number of worker processes. Default: number of cores.')
+    parser.add_argument('--checkpoint_dir', type=str, default=None,
+        help='Directory for checkpointing the training waveforms.')
+
+    args = parser.parse_args()
+
+    grid = SparseGrid([args.q_min, -args.chi_max, -args.chi_max], \
+        [args.q_max, args.chi_max, args.chi_max], args.level)
+    print('%d training waveforms, instead of %d for the tensor grid'%( \
+        len(grid), grid.get_tensor_size()))
+
+    training_data = generate_training_set(grid.points, \
+        num_procs=args.num_procs, checkpoint_dir=args.checkpoint_dir, \
+        dt=args.dt)
+    sur = build_surrogate(grid, training_data, args.dt, tol=args.tol)
+    print('Basis size: %d'%len(sur.eim_indices))
+
+    x_test = grid.lower + (grid.upper - grid.lower) \
+        *np.random.rand(args.num_test, grid.dim)
+    h_test = generate_training_set(x_test, num_procs=args.num_procs, \
+        dt=args.dt)
+    errors = []
+    for h, h_sur in zip(h_test, sur(x_test)):
+        h = align_to_grid(h, np.argmax(np.abs(h_sur)), len(sur.times))
+        errors.append(relative_max_error(h, h_sur))
+    print('Max relative error at %d random points: %e'%(args.num_test, \
+        np.max(errors)))
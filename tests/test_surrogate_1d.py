@@ -0,0 +1,52 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import surrogate_1d
+from surrogate_1d_loader import cubic_interp
+
+
+def chirp(q, dt=1.0/2048., duration=8.0):
+    """ Smooth chirp with a ringdown, like benchmark_1d.synthetic_waveform.
+    """
+    eta = q/(1.+q)**2
+    t_peak = duration*(0.9 + 0.1*(q - 1.))
+    t = np.arange(int((t_peak + 0.1)/dt))*dt
+    tau = np.sqrt((t_peak - t)**2 + 1e-4)
+    phase = -2*(5*tau/eta)**(5./8.)
+    amp = tau**(-0.25)/(1 + np.exp((t - t_peak)/0.005))
+    return t, amp, phase
+
+
+def test_sparse_time_indices_meet_tolerances():
+    times, amp, phase = chirp(1.5)
+    for amp_tol, phase_tol in [(1e-4, 1e-4), (1e-6, 1e-6)]:
+        idx = surrogate_1d.get_sparse_time_indices(times, amp, phase, \
+            amp_tol=amp_tol, phase_tol=phase_tol)
+        assert idx[0] == 0 and idx[-1] == len(times) - 1
+        assert len(idx) < len(times)/10
+
+        amp_err = np.abs(cubic_interp(times, times[idx], amp[idx]) - amp)
+        phase_err = np.abs(cubic_interp(times, times[idx], phase[idx]) \
+            - phase)
+        assert np.max(amp_err) <= amp_tol*np.max(amp)
+        assert np.max(phase_err) <= phase_tol
+
+
+def test_amp_phase_surrogate_accuracy():
+    dt = 1.0/2048.
+    qs = np.linspace(1, 2, 20)
+    training_data = [amp*np.exp(1j*phase) for _, amp, phase \
+        in [chirp(q, dt) for q in qs]]
+    times, training_data_aligned, _ = surrogate_1d.align_and_pad( \
+        training_data, dt)
+
+    sur = surrogate_1d.build_amp_phase_surrogate(qs, training_data_aligned, \
+        times)
+    h = sur(qs).transpose()
+    errors = np.max(np.abs(h - training_data_aligned), axis=0) \
+        /np.max(np.abs(training_data_aligned), axis=0)
+    assert np.max(errors) < 1e-4